@@ -0,0 +1,108 @@
+"""Helpers shared by the benchmark launcher and the benchmark runner."""
+import os
+import time
+
+SERVICES = ('database', 'processor', 'detector')
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples_ms):
+    """Summarize latency samples (milliseconds) into count/mean/p50/p95/p99/max."""
+    values = sorted(samples_ms)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values), 3),
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+        'max_ms': round(values[-1], 3)
+    }
+
+
+def child_pids(pid):
+    """Direct children of a process (e.g. gunicorn workers), found by scanning /proc."""
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def read_process_usage(pid):
+    """Return (cpu_seconds, rss_bytes, threads) for a Linux process from /proc."""
+    with open(f'/proc/{pid}/stat') as f:
+        # ชื่อโปรเซสอาจมีช่องว่าง จึงแยกหลังวงเล็บปิดตัวสุดท้าย
+        fields = f.read().rsplit(')', 1)[1].split()
+    utime, stime, threads = int(fields[11]), int(fields[12]), int(fields[17])
+    with open(f'/proc/{pid}/statm') as f:
+        rss_pages = int(f.read().split()[1])
+    return (utime + stime) / CLOCK_TICKS, rss_pages * PAGE_SIZE, threads
+
+
+def read_tree_usage(pid):
+    """Sum read_process_usage over a process and its direct children."""
+    cpu, rss, threads = read_process_usage(pid)
+    for child in child_pids(pid):
+        try:
+            child_cpu, child_rss, child_threads = read_process_usage(child)
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        cpu, rss, threads = cpu + child_cpu, rss + child_rss, threads + child_threads
+    return cpu, rss, threads
+
+
+class UsageSampler:
+    """Periodically sample CPU time, RSS and thread count of a set of process trees."""
+
+    def __init__(self, pids):
+        self.pids = dict(pids)
+        self.start_cpu = {}
+        self.last_cpu = {}
+        self.peak_rss = {}
+        self.peak_threads = {}
+        self.started_at = None
+
+    def sample(self):
+        for name, pid in self.pids.items():
+            try:
+                cpu, rss, threads = read_tree_usage(pid)
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+            self.start_cpu.setdefault(name, cpu)
+            self.last_cpu[name] = cpu
+            self.peak_rss[name] = max(self.peak_rss.get(name, 0), rss)
+            self.peak_threads[name] = max(self.peak_threads.get(name, 0), threads)
+        if self.started_at is None:
+            self.started_at = time.time()
+
+    def report(self):
+        elapsed = max(time.time() - (self.started_at or time.time()), 1e-9)
+        report = {}
+        for name in self.pids:
+            cpu = self.last_cpu.get(name, 0.0) - self.start_cpu.get(name, 0.0)
+            report[name] = {
+                'cpu_seconds': round(cpu, 3),
+                'cpu_percent': round(100.0 * cpu / elapsed, 1),
+                'peak_rss_mb': round(self.peak_rss.get(name, 0) / (1024 * 1024), 1),
+                'peak_threads': self.peak_threads.get(name, 0)
+            }
+        return report
@@ -0,0 +1,244 @@
+"""
+Accuracy vs. latency of the OCR preprocessing variants on a labeled plate set.
+
+The labeled set is a CSV with `image,text` columns; image paths are
+relative to the CSV file. Every variant (and `auto`, the per-plate
+selection used by the processor) is run over every image and reported
+with exact-match accuracy, character accuracy and preprocessing/OCR
+latency. The pre-check is evaluated separately: how many plates it would
+skip, how many of those OCR would have read correctly anyway, and how much
+OCR time skipping saves.
+
+    python benchmarks/ocr_preprocess.py --labels plates/labels.csv
+    python benchmarks/ocr_preprocess.py --synthetic 200 --stub
+    python benchmarks/ocr_preprocess.py --labels plates/labels.csv --min-width 40 --min-height 12
+
+--synthetic renders ASCII plates with varying size (down to ~20 px wide),
+contrast, blur and tilt (cv2 cannot draw Thai glyphs, so use a real
+labeled set for Thai accuracy). --min-width, --min-height, --min-contrast,
+--min-sharpness, --min-brightness and --max-brightness set the pre-check
+thresholds being evaluated; their defaults are the processor's. The
+processor runs with the pre-check off (OCR_PRECHECK) until these have been
+evaluated on a real labeled set. --stub replaces easyocr with the stand-in reader from stubs.py;
+only the latency columns are meaningful then.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from common import REPO_ROOT, summarize
+
+sys.path.insert(0, os.path.join(REPO_ROOT, 'processor'))
+from plate_preprocess import DEFAULT_THRESHOLDS, VARIANTS, PlatePreprocessor, UnreadablePlate  # noqa: E402
+
+PRECHECK_THRESHOLDS = ('min_width', 'min_height', 'min_contrast', 'min_sharpness',
+                       'min_brightness', 'max_brightness')
+
+
+def normalize(text):
+    """Same cleanup as the processor, then ignore spacing and case."""
+    return ''.join(c for c in text if c.isalnum()).upper()
+
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def char_accuracy(predicted, expected):
+    if not expected:
+        return 1.0 if not predicted else 0.0
+    return max(0.0, 1.0 - edit_distance(predicted, expected) / len(expected))
+
+
+def load_labels(path):
+    base = os.path.dirname(os.path.abspath(path))
+    samples = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            image = cv2.imread(os.path.join(base, row['image']))
+            if image is None:
+                print(f"skipping unreadable image: {row['image']}")
+                continue
+            samples.append((row['image'], image, row['text']))
+    return samples
+
+
+def make_synthetic_plates(count, out_dir, seed=0):
+    """Render labeled plates into out_dir and return the path of labels.csv."""
+    rng = random.Random(seed)
+    letters = 'ABCDEFGHJKLMNPRSTUVWXYZ'
+    labels_path = os.path.join(out_dir, 'labels.csv')
+    with open(labels_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['image', 'text'])
+        for i in range(count):
+            text = f"{rng.choice('123456789')}{rng.choice(letters)}{rng.choice(letters)} {rng.randint(1000, 9999)}"
+            plate = np.full((60, 240, 3), 235, dtype=np.uint8)
+            cv2.rectangle(plate, (2, 2), (237, 57), (20, 20, 20), 2)
+            cv2.putText(plate, text, (14, 42), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (20, 20, 20), 2, cv2.LINE_AA)
+
+            # สุ่มสภาพภาพให้ใกล้เคียงภาพจากกล้องจริง
+            angle = rng.uniform(-12, 12)
+            matrix = cv2.getRotationMatrix2D((120, 30), angle, 1.0)
+            plate = cv2.warpAffine(plate, matrix, (240, 60), borderMode=cv2.BORDER_REPLICATE)
+            contrast = rng.uniform(0.15, 1.0)
+            offset = rng.uniform(10, 230 - 215 * contrast)
+            plate = np.clip(plate.astype(np.float32) * contrast + offset, 0, 255).astype(np.uint8)
+            blur = rng.choice((0, 0, 3, 5, 9))
+            if blur:
+                plate = cv2.GaussianBlur(plate, (blur, blur), 0)
+            # ป้ายจากกล้องระยะไกลอาจกว้างเพียง 20 px จึงสุ่มให้มีภาพเล็กกว่าเกณฑ์ขนาดที่ทดสอบด้วย
+            scale = rng.uniform(0.08, 1.2)
+            plate = cv2.resize(plate, (max(8, int(240 * scale)), max(4, int(60 * scale))),
+                               interpolation=cv2.INTER_AREA)
+
+            name = f'plate_{i:04d}.png'
+            cv2.imwrite(os.path.join(out_dir, name), plate)
+            writer.writerow([name, text])
+    return labels_path
+
+
+def create_reader(args):
+    if args.stub:
+        import stubs
+        return stubs.FakeReader()
+    import easyocr
+    return easyocr.Reader(args.languages.split(','), gpu=False)
+
+
+def read_text(reader, image):
+    results = reader.readtext(image)
+    return ' '.join(r[1] for r in results) if results else ''
+
+
+def run_variant(reader, samples, variant):
+    preprocessor = PlatePreprocessor(variant=variant, precheck=False)
+    preprocess_ms, ocr_ms, exact, chars, chosen, outcomes = [], [], 0, 0.0, {}, []
+    for name, image, expected in samples:
+        start = time.perf_counter()
+        try:
+            processed, used, _ = preprocessor.prepare(image)
+        except UnreadablePlate:
+            # ภาพว่าง อ่านไม่ได้ไม่ว่าจะใช้วิธีไหน
+            outcomes.append((name, False, 0.0))
+            continue
+        middle = time.perf_counter()
+        predicted = read_text(reader, processed)
+        end = time.perf_counter()
+
+        preprocess_ms.append((middle - start) * 1000.0)
+        ocr_ms.append((end - middle) * 1000.0)
+        chosen[used] = chosen.get(used, 0) + 1
+        correct = normalize(predicted) == normalize(expected)
+        exact += correct
+        chars += char_accuracy(normalize(predicted), normalize(expected))
+        outcomes.append((name, correct, (end - middle) * 1000.0))
+
+    total = len(samples) or 1
+    report = {
+        'exact_accuracy': round(exact / total, 4),
+        'char_accuracy': round(chars / total, 4),
+        'preprocess': summarize(preprocess_ms),
+        'ocr': summarize(ocr_ms),
+        'ms_per_image': round((sum(preprocess_ms) + sum(ocr_ms)) / total, 3)
+    }
+    if variant == 'auto':
+        report['selected'] = chosen
+    return report, outcomes
+
+
+def evaluate_precheck(samples, outcomes, thresholds=None):
+    """Compare the pre-check prediction with what OCR (auto variant) actually achieved."""
+    preprocessor = PlatePreprocessor(variant='auto', precheck=True, thresholds=thresholds)
+    skipped, skipped_correct, saved_ms, reasons = 0, 0, 0.0, {}
+    for (name, image, _), (_, correct, ocr_ms) in zip(samples, outcomes):
+        try:
+            preprocessor.prepare(image)
+        except UnreadablePlate as e:
+            skipped += 1
+            skipped_correct += correct
+            saved_ms += ocr_ms
+            reasons[e.reason] = reasons.get(e.reason, 0) + 1
+    correct_total = sum(correct for _, correct, _ in outcomes)
+    return {
+        'skipped': skipped,
+        'skipped_share': round(skipped / (len(samples) or 1), 4),
+        # ป้ายที่อ่านถูกแต่ถูกข้ามไป คือต้นทุนของการ pre-check
+        'skipped_but_readable': skipped_correct,
+        'recall_kept': round(1.0 - skipped_correct / correct_total, 4) if correct_total else None,
+        'ocr_ms_saved': round(saved_ms, 1),
+        'reasons': reasons,
+        'thresholds': {key: preprocessor.thresholds[key] for key in PRECHECK_THRESHOLDS}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--labels', help='CSV with image,text columns')
+    parser.add_argument('--synthetic', type=int, default=0, help='generate this many labeled synthetic plates')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--variants', nargs='*', default=list(VARIANTS) + ['auto'],
+                        choices=list(VARIANTS) + ['auto'])
+    parser.add_argument('--languages', default='th,en', help='easyocr languages')
+    parser.add_argument('--stub', action='store_true', help='use the stand-in reader (latency only)')
+    parser.add_argument('--output', default=None, help='write the result JSON here')
+    for key in PRECHECK_THRESHOLDS:
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(DEFAULT_THRESHOLDS[key]),
+                            default=DEFAULT_THRESHOLDS[key], help=f'pre-check threshold {key}')
+    args = parser.parse_args()
+
+    if bool(args.labels) == bool(args.synthetic):
+        parser.error('give exactly one of --labels or --synthetic')
+
+    workdir = None
+    labels = args.labels
+    if args.synthetic:
+        workdir = tempfile.mkdtemp(prefix='plates-')
+        labels = make_synthetic_plates(args.synthetic, workdir, args.seed)
+    samples = load_labels(labels)
+    reader = create_reader(args)
+
+    result = {'labels': labels, 'images': len(samples), 'stub': args.stub, 'variants': {}}
+    for variant in args.variants:
+        report, outcomes = run_variant(reader, samples, variant)
+        result['variants'][variant] = report
+        if variant == 'auto':
+            thresholds = {key: getattr(args, key) for key in PRECHECK_THRESHOLDS}
+            result['precheck'] = evaluate_precheck(samples, outcomes, thresholds)
+
+    print(f"{len(samples)} plates from {labels}{' (stub reader)' if args.stub else ''}\n")
+    print(f"  {'variant':10s} {'exact':>7s} {'chars':>7s} {'prep p50':>9s} {'prep p95':>9s} {'ocr p50':>9s} {'ms/img':>8s}")
+    for variant, report in result['variants'].items():
+        print(f"  {variant:10s} {report['exact_accuracy']:>7.3f} {report['char_accuracy']:>7.3f} "
+              f"{report['preprocess'].get('p50_ms', 0):>9} {report['preprocess'].get('p95_ms', 0):>9} "
+              f"{report['ocr'].get('p50_ms', 0):>9} {report['ms_per_image']:>8}")
+    if 'precheck' in result:
+        precheck = result['precheck']
+        print(f"\npre-check: skips {precheck['skipped']} ({precheck['skipped_share']:.1%}), "
+              f"{precheck['skipped_but_readable']} of them readable, saves {precheck['ocr_ms_saved']} ms OCR "
+              f"{precheck['reasons']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f'\nresult written to {args.output}')
+    if workdir:
+        print(f'synthetic plates kept in {workdir}')
+
+
+if __name__ == '__main__':
+    main()
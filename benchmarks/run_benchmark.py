@@ -0,0 +1,348 @@
+"""
+End-to-end benchmark of the detector -> processor -> database chain.
+
+Starts the three services locally with stand-in models (see stubs.py),
+replays sample videos through the detector's /jobs API at a configurable
+concurrency and reports:
+
+- frames/sec and violations/sec for the whole run
+- p50/p95/p99 latency of every HTTP hop and every handled endpoint
+- CPU time, CPU %, peak RSS and peak thread count per service
+
+With --server gunicorn the database and processor run under the gunicorn
+workers from their Dockerfiles instead of the Flask development server.
+
+Runs on a CPU-only Linux box without network access. Results are written
+as JSON so runs can be compared:
+
+    python benchmarks/run_benchmark.py --synthetic 4 --frames 300 --concurrency 2
+    python benchmarks/run_benchmark.py --videos clip.mp4 --repeat 8 \\
+        --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import requests
+
+from common import SERVICES, UsageSampler
+from serve import GUNICORN_OPTIONS
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ค่าที่ใช้เปรียบเทียบกับ baseline: (ชื่อ, ค่ามากกว่าดีกว่าหรือไม่)
+COMPARED_METRICS = (
+    ('frames_per_second', True),
+    ('violations_per_second', True),
+)
+
+
+def make_synthetic_video(path, frames, width=854, height=480, fps=30):
+    """Write a small moving-pattern video that OpenCV can decode without extra codecs."""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    rng = np.random.default_rng(len(path))
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    for i in range(frames):
+        frame = np.roll(background, i * 4, axis=1)
+        cv2.putText(frame, f'{i}', (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        writer.write(frame)
+    writer.release()
+
+
+def prepare_videos(args, workdir):
+    upload_dir = os.path.join(workdir, 'uploads')
+    os.makedirs(upload_dir, exist_ok=True)
+
+    sources = []
+    for i in range(args.synthetic):
+        path = os.path.join(upload_dir, f'synthetic_{i}.avi')
+        make_synthetic_video(path, args.frames)
+        sources.append(path)
+    for video in args.videos:
+        sources.append(os.path.abspath(video))
+    if not sources:
+        raise SystemExit('no videos: pass --videos or --synthetic')
+
+    # แต่ละรอบใช้ชื่อไฟล์ต่างกัน เพราะ detector รวมงานของไฟล์ชื่อเดียวกันเป็นงานเดียว
+    videos = []
+    for r in range(args.repeat):
+        for source in sources:
+            stem, ext = os.path.splitext(os.path.basename(source))
+            target = os.path.join(upload_dir, f'{stem}_r{r}{ext}')
+            if not os.path.exists(target):
+                os.symlink(source, target)
+            videos.append(target)
+    return videos
+
+
+class ServiceCluster:
+    """Start and stop the benchmarked services as subprocesses."""
+
+    def __init__(self, workdir, base_port, extra_env, server='flask'):
+        self.workdir = workdir
+        self.server = server
+        self.ports = {name: base_port + i for i, name in enumerate(SERVICES)}
+        self.processes = {}
+        self.logs = {}
+        self.env = dict(os.environ)
+        self.env.update({
+            'PYTHONUNBUFFERED': '1',
+            'DETECTION_FOLDER': os.path.join(workdir, 'detections'),
+            'DB_PATH': os.path.join(workdir, 'data', 'violations.db'),
+            'DATABASE_URL': self.url('database'),
+            'PROCESSOR_URL': self.url('processor'),
+            'MODEL_PATH': os.path.join(workdir, 'stand-in.pt'),
+            'CUDA_VISIBLE_DEVICES': ''
+        })
+        self.env.update(extra_env)
+
+    def url(self, service):
+        return f'http://127.0.0.1:{self.ports[service]}'
+
+    def start(self, timeout=120):
+        for service in SERVICES:
+            log = open(os.path.join(self.workdir, f'{service}.log'), 'w')
+            self.logs[service] = log
+            command = [sys.executable, os.path.join(BENCH_DIR, 'serve.py'), service,
+                       '--port', str(self.ports[service])]
+            if service in GUNICORN_OPTIONS:
+                command += ['--server', self.server]
+            self.processes[service] = subprocess.Popen(
+                command,
+                cwd=self.workdir, env=self.env, stdout=log, stderr=subprocess.STDOUT
+            )
+
+        deadline = time.time() + timeout
+        for service in SERVICES:
+            while True:
+                if self.processes[service].poll() is not None:
+                    raise RuntimeError(f'{service} exited during startup, see {self.logs[service].name}')
+                try:
+                    requests.get(f'{self.url(service)}/_bench/stats', timeout=1)
+                    break
+                except requests.exceptions.RequestException:
+                    if time.time() > deadline:
+                        raise RuntimeError(f'{service} did not start within {timeout}s')
+                    time.sleep(0.2)
+
+    def pids(self):
+        return {name: proc.pid for name, proc in self.processes.items()}
+
+    def stats(self):
+        stats = {}
+        for service in SERVICES:
+            try:
+                stats.update(requests.get(f'{self.url(service)}/_bench/stats', timeout=5).json())
+            except requests.exceptions.RequestException as e:
+                print(f'could not read stats from {service}: {e}')
+        return stats
+
+    def stop(self):
+        for proc in self.processes.values():
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+        for proc in self.processes.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        for log in self.logs.values():
+            log.close()
+
+
+def count_violations(cluster):
+    response = requests.get(f"{cluster.url('database')}/violations", timeout=30)
+    response.raise_for_status()
+    return len(response.json())
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='helmet-bench-', dir=args.workdir)
+    videos = prepare_videos(args, workdir)
+    print(f'workdir: {workdir} ({len(videos)} videos)')
+
+    cluster = ServiceCluster(workdir, args.base_port, {
+        'MAX_RUNNING_JOBS': str(args.concurrency),
+        'BENCH_VIOLATION_EVERY': str(args.violation_every),
+        'BENCH_INFERENCE_MS': str(args.inference_ms),
+        'BENCH_OCR_MS': str(args.ocr_ms),
+        'SEGMENT_WORKERS': str(args.segment_workers),
+        'PARALLEL_MIN_SECONDS': str(args.parallel_min_seconds)
+    }, server=args.server)
+    try:
+        cluster.start()
+        sampler = UsageSampler(cluster.pids())
+        sampler.sample()
+        detector = cluster.url('detector')
+
+        started = time.time()
+        job_ids = []
+        for video in videos:
+            response = requests.post(f'{detector}/jobs', json={
+                'video_path': video,
+                'filename': os.path.basename(video)
+            }, timeout=10)
+            response.raise_for_status()
+            job_ids.append(response.json()['job_id'])
+
+        # รอให้ทุกงานเสร็จ พร้อมเก็บการใช้ทรัพยากรระหว่างรอ
+        jobs = {}
+        while True:
+            sampler.sample()
+            jobs = {job_id: requests.get(f'{detector}/jobs/{job_id}', timeout=5).json() for job_id in job_ids}
+            if all(job['state'] in ('done', 'failed', 'cancelled') for job in jobs.values()):
+                break
+            if time.time() - started > args.timeout:
+                raise RuntimeError(f'jobs did not finish within {args.timeout}s')
+            time.sleep(args.poll_interval)
+        detect_elapsed = time.time() - started
+
+        # processor/database ทำงานต่อหลัง detector เสร็จ รอจนจำนวนการละเมิดคงที่
+        violations, stable_since = -1, time.time()
+        while time.time() - stable_since < args.settle:
+            sampler.sample()
+            current = count_violations(cluster)
+            if current != violations:
+                violations, stable_since = current, time.time()
+            time.sleep(args.poll_interval)
+        total_elapsed = stable_since - started
+
+        frames = sum(job['frames_done'] for job in jobs.values())
+        failed = [job for job in jobs.values() if job['state'] != 'done']
+        return {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': {
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'cpus': os.cpu_count()
+            },
+            'config': {
+                'videos': len(videos),
+                'concurrency': args.concurrency,
+                'server': args.server,
+                'segment_workers': args.segment_workers,
+                'parallel_min_seconds': args.parallel_min_seconds,
+                'violation_every': args.violation_every,
+                'inference_ms': args.inference_ms,
+                'ocr_ms': args.ocr_ms
+            },
+            'frames': frames,
+            'violations': violations,
+            'failed_jobs': len(failed),
+            'detect_seconds': round(detect_elapsed, 3),
+            'total_seconds': round(total_elapsed, 3),
+            'frames_per_second': round(frames / detect_elapsed, 2) if detect_elapsed else 0.0,
+            'violations_per_second': round(violations / total_elapsed, 2) if total_elapsed else 0.0,
+            'jobs': [
+                {key: job[key] for key in ('filename', 'state', 'frames_done', 'fps', 'error')}
+                for job in jobs.values()
+            ],
+            'latency': cluster.stats(),
+            'resources': sampler.report()
+        }
+    finally:
+        cluster.stop()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def lookup(result, path):
+    for key in path:
+        if not isinstance(result, dict):
+            return None
+        result = result.get(key)
+    return result
+
+
+def compare(result, baseline, max_regression, min_samples):
+    """Print changes against a baseline result; return False if any metric regressed too far."""
+    ok = True
+    print(f'\ncomparison with baseline from {baseline.get("timestamp")}:')
+    rows = [((name,), higher_is_better) for name, higher_is_better in COMPARED_METRICS]
+    for name in sorted(set(result['latency']) & set(baseline.get('latency', {}))):
+        # ข้ามรายการที่มีตัวอย่างน้อย เช่นการ poll ของ benchmark เอง ซึ่งแกว่งมาก
+        counts = (result['latency'][name].get('count', 0), baseline['latency'][name].get('count', 0))
+        if min(counts) >= min_samples:
+            rows.append((('latency', name, 'p95_ms'), False))
+
+    for path, higher_is_better in rows:
+        current, previous = lookup(result, path), lookup(baseline, path)
+        if not isinstance(current, (int, float)) or not isinstance(previous, (int, float)) or not previous:
+            continue
+        change = (current - previous) / previous
+        regressed = change < -max_regression if higher_is_better else change > max_regression
+        ok = ok and not regressed
+        label = '.'.join(path)
+        print(f'  {label:70s} {previous:10.2f} -> {current:10.2f} ({change:+.1%}){"  REGRESSION" if regressed else ""}')
+    return ok
+
+
+def print_summary(result):
+    print(f"\nframes: {result['frames']}  violations: {result['violations']}  failed jobs: {result['failed_jobs']}")
+    print(f"frames/sec: {result['frames_per_second']}  violations/sec: {result['violations_per_second']}")
+    print('\nlatency (ms):')
+    for name, stats in sorted(result['latency'].items()):
+        if stats.get('count'):
+            print(f"  {name:60s} n={stats['count']:<6d} p50={stats['p50_ms']:<9} p95={stats['p95_ms']:<9} p99={stats['p99_ms']}")
+    print('\nresources:')
+    for name, usage in result['resources'].items():
+        print(f"  {name:10s} cpu={usage['cpu_seconds']}s ({usage['cpu_percent']}%) peak_rss={usage['peak_rss_mb']}MB threads={usage['peak_threads']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--videos', nargs='*', default=[], help='sample videos to replay')
+    parser.add_argument('--synthetic', type=int, default=0, help='number of synthetic videos to generate')
+    parser.add_argument('--frames', type=int, default=300, help='frames per synthetic video')
+    parser.add_argument('--repeat', type=int, default=1, help='replay every video this many times')
+    parser.add_argument('--concurrency', type=int, default=2, help='videos processed at once (MAX_RUNNING_JOBS)')
+    parser.add_argument('--segment-workers', type=int, default=1,
+                        help='split each video across this many workers (SEGMENT_WORKERS, 1 = sequential)')
+    parser.add_argument('--parallel-min-seconds', type=float, default=0.0,
+                        help='only split videos at least this long (PARALLEL_MIN_SECONDS)')
+    parser.add_argument('--violation-every', type=int, default=15, help='stand-in model emits a violation every N frames')
+    parser.add_argument('--inference-ms', type=float, default=0.0, help='simulated model latency per frame')
+    parser.add_argument('--ocr-ms', type=float, default=0.0, help='simulated OCR latency per plate')
+    parser.add_argument('--server', choices=('flask', 'gunicorn'), default='flask',
+                        help='server for the database and processor (the detector always runs its own server)')
+    parser.add_argument('--base-port', type=int, default=15001)
+    parser.add_argument('--timeout', type=float, default=1800.0)
+    parser.add_argument('--settle', type=float, default=3.0, help='seconds without new violations before stopping')
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--workdir', default=None, help='parent directory for the temporary run directory')
+    parser.add_argument('--keep-workdir', action='store_true')
+    parser.add_argument('--output', default=None, help='write the result JSON here')
+    parser.add_argument('--compare', default=None, help='baseline result JSON to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.10,
+                        help='fail when a compared metric is worse than the baseline by more than this fraction')
+    parser.add_argument('--min-samples', type=int, default=20,
+                        help='only compare latencies with at least this many samples in both runs')
+    args = parser.parse_args()
+
+    result = run(args)
+    print_summary(result)
+
+    output = args.output or os.path.join(BENCH_DIR, 'results', f"{result['timestamp'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f'\nresult written to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.max_regression, args.min_samples):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Run one service in-process for benchmarking.
+
+    python benchmarks/serve.py detector --port 5001
+    python benchmarks/serve.py database --port 5003 --server gunicorn
+
+The launcher installs the stand-in models from stubs.py, times every
+outgoing HTTP request (the hop to the next service) and every handled
+request, and exposes the summaries at GET /_bench/stats.
+
+With --server gunicorn the service runs under the same gunicorn worker
+class its Dockerfile uses (see GUNICORN_OPTIONS) instead of the Flask
+development server.
+"""
+import argparse
+import importlib
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import stubs
+from common import REPO_ROOT, SERVICES, summarize
+
+MODULES = {
+    'database': 'database',
+    'processor': 'processor',
+    'detector': 'detector'
+}
+
+# ต้องตรงกับ CMD ใน Dockerfile ของแต่ละ service
+GUNICORN_OPTIONS = {
+    'database': {'worker_class': 'gthread', 'workers': 1, 'threads': 8},
+    'processor': {'worker_class': 'gthread', 'workers': 1, 'threads': 8}
+}
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self._samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples[name].append(seconds * 1000.0)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: summarize(values) for name, values in self._samples.items()}
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+
+def instrument_outgoing(recorder, service):
+    """Time every requests call made by the service, grouped by target endpoint."""
+    import requests
+
+    original = requests.Session.request
+
+    def timed_request(self, method, url, *args, **kwargs):
+        parts = urlsplit(url)
+        endpoint = '/' + parts.path.strip('/').split('/')[0]
+        start = time.perf_counter()
+        try:
+            return original(self, method, url, *args, **kwargs)
+        finally:
+            recorder.record(f'{service} -> {parts.netloc}{endpoint}', time.perf_counter() - start)
+
+    requests.Session.request = timed_request
+
+
+def instrument_handlers(app, recorder, service):
+    """Time every request handled by the Flask app, grouped by route."""
+    from flask import g, request, jsonify
+
+    @app.before_request
+    def _bench_start():
+        g.bench_start = time.perf_counter()
+
+    @app.after_request
+    def _bench_stop(response):
+        start = getattr(g, 'bench_start', None)
+        if start is not None and request.url_rule is not None and not request.path.startswith('/_bench'):
+            recorder.record(f'{service} {request.method} {request.url_rule.rule}', time.perf_counter() - start)
+        return response
+
+    @app.route('/_bench/stats', methods=['GET'])
+    def _bench_stats():
+        return jsonify(recorder.snapshot())
+
+    @app.route('/_bench/reset', methods=['POST'])
+    def _bench_reset():
+        recorder.reset()
+        return jsonify({'success': True})
+
+
+def load_service(service):
+    service_dir = os.path.join(REPO_ROOT, service)
+    sys.path.insert(0, service_dir)
+    # docker-compose คัดลอก shared/ เข้า image ของทุก service
+    sys.path.insert(1, os.path.join(REPO_ROOT, 'shared'))
+    module = importlib.import_module(MODULES[service])
+
+    if service == 'detector':
+        module.model = stubs.FakeYOLO()
+    return module
+
+
+def run_gunicorn(app, service, host, port):
+    from gunicorn.app.base import BaseApplication
+
+    class BenchApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            for key, value in GUNICORN_OPTIONS[service].items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    BenchApplication().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('service', choices=SERVICES)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--server', choices=('flask', 'gunicorn'), default='flask')
+    args = parser.parse_args()
+    if args.server == 'gunicorn' and args.service not in GUNICORN_OPTIONS:
+        parser.error(f'{args.service} has no gunicorn configuration')
+
+    stubs.install()
+    recorder = LatencyRecorder()
+    instrument_outgoing(recorder, args.service)
+    module = load_service(args.service)
+    instrument_handlers(module.app, recorder, args.service)
+
+    if args.server == 'gunicorn':
+        run_gunicorn(module.app, args.service, args.host, args.port)
+    else:
+        module.app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
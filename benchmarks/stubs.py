@@ -0,0 +1,108 @@
+"""
+Stand-ins for the heavy models so the services can be benchmarked on a
+CPU-only machine with no network and no model weights.
+
+FakeYOLO mimics the slice of the ultralytics Results API the detector uses
+and emits a full violation (motorcycle + no helmet + plate) every
+BENCH_VIOLATION_EVERY frames. FakeReader mimics easyocr.Reader.readtext.
+Both can simulate model cost with BENCH_INFERENCE_MS / BENCH_OCR_MS.
+"""
+import os
+import sys
+import threading
+import time
+import types
+
+import cv2
+import numpy as np
+
+
+class _Tensor:
+    """Minimal stand-in for a torch tensor: .cpu().numpy() and .tolist()."""
+
+    def __init__(self, array):
+        self._array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self._array
+
+    def tolist(self):
+        return self._array.tolist()
+
+
+class _Boxes:
+    def __init__(self, data):
+        # data rows: x1, y1, x2, y2, conf, cls (same layout as ultralytics Boxes.data)
+        self.data = _Tensor(data)
+        self.xyxy = _Tensor(data[:, :4])
+        self.conf = _Tensor(data[:, 4])
+        self.cls = _Tensor(data[:, 5])
+
+    def __len__(self):
+        return len(self.data.numpy())
+
+
+class _Results:
+    def __init__(self, data):
+        self.boxes = _Boxes(data)
+
+
+class FakeYOLO:
+    """Tiny deterministic detector with the call signature of ultralytics.YOLO."""
+
+    def __init__(self, model_path=None, violation_every=None, inference_ms=None):
+        self.violation_every = violation_every or int(os.getenv('BENCH_VIOLATION_EVERY', '15'))
+        self.inference_ms = inference_ms if inference_ms is not None else float(os.getenv('BENCH_INFERENCE_MS', '0'))
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, frame, **kwargs):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        # งานเล็ก ๆ แทน forward pass เพื่อให้มีต้นทุนต่อเฟรมจริงบ้าง
+        small = cv2.resize(frame, (64, 64), interpolation=cv2.INTER_AREA)
+        brightness = float(small.mean()) / 255.0
+        if self.inference_ms:
+            time.sleep(self.inference_ms / 1000.0)
+
+        height, width = frame.shape[:2]
+        if calls % self.violation_every == 0:
+            x = (calls * 7) % max(width - 200, 1)
+            data = np.array([
+                [x, 100, x + 180, 400, 0.90, 0],           # Motorcycle
+                [x + 40, 60, x + 140, 150, 0.85, 3],       # NoHelmet
+                [x + 50, 330, x + 130, 380, 0.80 + 0.1 * brightness, 2]  # LicensePlate
+            ], dtype=np.float32)
+        elif calls % 3 == 0:
+            data = np.array([[10, 10, 110, 110, 0.75, 1]], dtype=np.float32)  # Helmet
+        else:
+            data = np.zeros((0, 6), dtype=np.float32)
+        return [_Results(data)]
+
+
+class FakeReader:
+    """Stand-in for easyocr.Reader returning a fixed plate string."""
+
+    def __init__(self, languages=None, **kwargs):
+        self.ocr_ms = float(os.getenv('BENCH_OCR_MS', '0'))
+        self.text = os.getenv('BENCH_OCR_TEXT', '1กข 1234')
+
+    def readtext(self, image, **kwargs):
+        if self.ocr_ms:
+            time.sleep(self.ocr_ms / 1000.0)
+        height, width = image.shape[:2]
+        return [([[0, 0], [width, 0], [width, height], [0, height]], self.text, 0.9)]
+
+
+def install():
+    """Register fake `ultralytics` and `easyocr` modules before a service is imported."""
+    ultralytics = types.ModuleType('ultralytics')
+    ultralytics.YOLO = FakeYOLO
+    easyocr = types.ModuleType('easyocr')
+    easyocr.Reader = FakeReader
+    sys.modules['ultralytics'] = ultralytics
+    sys.modules['easyocr'] = easyocr
@@ -1,10 +1,21 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g
 import sqlite3
 import os
+import time
 from datetime import datetime
+from functools import lru_cache
+from prometheus_client import Histogram, generate_latest, CONTENT_TYPE_LATEST
+from service_logging import setup_logging
+
+logger = setup_logging('database')
+
+# Prometheus metrics
+STAGE_LATENCY = Histogram('database_stage_seconds', 'เวลาที่ใช้ในการทำงานกับฐานข้อมูล', ['stage'])
+REQUEST_LATENCY = Histogram('database_request_seconds', 'เวลาตอบคำขอ HTTP', ['method', 'endpoint'])
 
 app = Flask(__name__)
 DB_PATH = os.getenv('DB_PATH', 'violations.db')
+VIOLATION_CACHE_SIZE = int(os.getenv('VIOLATION_CACHE_SIZE', '4096'))
 
 def init_db():
     """สร้างฐานข้อมูลและตารางเก็บข้อมูลการละเมิด พร้อมค่าความแม่นยำแยกตามประเภท"""
@@ -23,12 +34,21 @@ def init_db():
                     confidence FLOAT,
                     motorcycle_conf FLOAT,
                     no_helmet_conf FLOAT,
-                    plate_conf FLOAT
+                    plate_conf FLOAT,
+                    trace_id TEXT
                 )
             ''')
-            print("สร้างตารางฐานข้อมูลสำเร็จ")
+
+            # เพิ่มคอลัมน์ให้ฐานข้อมูลที่สร้างก่อนมี trace_id
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(violations)')}
+            if 'trace_id' not in columns:
+                conn.execute('ALTER TABLE violations ADD COLUMN trace_id TEXT')
+
+            # ใช้ทั้งการเรียงลำดับแบบแบ่งหน้าและการลบข้อมูลเก่าตามระยะเวลาเก็บรักษา
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_violations_timestamp ON violations(timestamp)')
+            logger.info("สร้างตารางฐานข้อมูลสำเร็จ")
     except sqlite3.Error as e:
-        print(f"เกิดข้อผิดพลาดในการสร้างฐานข้อมูล: {e}")
+        logger.error("เกิดข้อผิดพลาดในการสร้างฐานข้อมูล: %s", e)
         raise
 
 @app.route('/violations', methods=['POST'])
@@ -47,14 +67,17 @@ def add_violation():
                 'error': f'ข้อมูลไม่ครบถ้วน: {", ".join(missing_fields)}'
             }), 400
 
-        with sqlite3.connect(DB_PATH) as conn:
+        # รหัสติดตามจาก detector ที่ส่งต่อมาผ่าน processor
+        trace_id = data.get('trace_id') or request.headers.get('X-Trace-Id')
+
+        with sqlite3.connect(DB_PATH) as conn, STAGE_LATENCY.labels(stage='insert').time():
             conn.execute(
                 '''INSERT INTO violations 
                    (id, video_name, frame_number, timestamp,
                     license_plate_text, license_plate_confidence,
                     motorcycle_image, plate_image, confidence,
-                    motorcycle_conf, no_helmet_conf, plate_conf)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    motorcycle_conf, no_helmet_conf, plate_conf, trace_id)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                 (
                     data['id'],
                     data['video_name'],
@@ -67,7 +90,8 @@ def add_violation():
                     data.get('confidence', 0.0),  # ค่าความแม่นยำรวม
                     data.get('motorcycle_conf', 0.0),  # ความแม่นยำการตรวจจับรถ
                     data.get('no_helmet_conf', 0.0),   # ความแม่นยำการตรวจจับคนไม่ใส่หมวก
-                    data.get('plate_conf', 0.0)        # ความแม่นยำการตรวจจับป้าย
+                    data.get('plate_conf', 0.0),       # ความแม่นยำการตรวจจับป้าย
+                    trace_id
                 )
             )
             return jsonify({
@@ -80,30 +104,114 @@ def add_violation():
             'error': 'ข้อมูลซ้ำ: พบ ID นี้ในระบบแล้ว'
         }), 409
     except sqlite3.Error as e:
-        print(f"เกิดข้อผิดพลาดในการบันทึกข้อมูล: {e}")
+        logger.error("เกิดข้อผิดพลาดในการบันทึกข้อมูล: %s", e)
         return jsonify({'error': str(e)}), 500
     except Exception as e:
-        print(f"เกิดข้อผิดพลาดที่ไม่คาดคิด: {e}")
+        logger.error("เกิดข้อผิดพลาดที่ไม่คาดคิด: %s", e)
         return jsonify({'error': 'เกิดข้อผิดพลาดในการประมวลผล'}), 500
 
 @app.route('/violations', methods=['GET'])
 def fetch_violations():
-    """ดึงข้อมูลการละเมิดพร้อมค่าความแม่นยำทั้งหมด"""
+    """
+    ดึงข้อมูลการละเมิดพร้อมค่าความแม่นยำ เรียงจากใหม่ไปเก่า
+    แบ่งหน้าได้ด้วย ?limit=&offset= ถ้าไม่ระบุ limit จะคืนทั้งหมด กรองตามวิดีโอด้วย ?video_name=
+    จำนวนทั้งหมดที่ตรงเงื่อนไข (ไม่นับ limit/offset) อยู่ใน header X-Total-Count
+    """
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        video_name = request.args.get('video_name')
+        limit = request.args.get('limit', type=int)
+        offset = request.args.get('offset', 0, type=int)
+        if (limit is not None and limit < 0) or offset < 0:
+            return jsonify({'error': 'limit และ offset ต้องไม่ติดลบ'}), 400
+
+        with sqlite3.connect(DB_PATH) as conn, STAGE_LATENCY.labels(stage='query').time():
             conn.row_factory = sqlite3.Row
             cursor = conn.execute('''
                 SELECT * FROM violations 
+                WHERE ? IS NULL OR video_name = ?
                 ORDER BY timestamp DESC
-            ''')
+                LIMIT ? OFFSET ?
+            ''', (video_name, video_name, limit if limit is not None else -1, offset))
             violations = [dict(row) for row in cursor.fetchall()]
-            return jsonify(violations)
+            total = conn.execute(
+                'SELECT COUNT(*) FROM violations WHERE ? IS NULL OR video_name = ?',
+                (video_name, video_name)
+            ).fetchone()[0]
+            return jsonify(violations), 200, {'X-Total-Count': str(total)}
+
+    except sqlite3.Error as e:
+        logger.error("เกิดข้อผิดพลาดในการดึงข้อมูล: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/violations', methods=['DELETE'])
+def delete_violations():
+    """ลบข้อมูลการละเมิดที่บันทึกก่อนเวลาที่กำหนด (?before=<ISO datetime>) ใช้ตามนโยบายเก็บรักษาข้อมูล"""
+    before = request.args.get('before')
+    if not before:
+        return jsonify({'error': 'ต้องระบุ before'}), 400
+    try:
+        cutoff = datetime.fromisoformat(before)
+    except ValueError:
+        return jsonify({'error': f'รูปแบบเวลาไม่ถูกต้อง: {before}'}), 400
+
+    try:
+        with sqlite3.connect(DB_PATH) as conn, STAGE_LATENCY.labels(stage='delete').time():
+            deleted = conn.execute('DELETE FROM violations WHERE timestamp < ?', (cutoff,)).rowcount
+        # ข้อมูลที่ถูกลบต้องไม่ถูกคืนจาก cache อีก
+        load_violation.cache_clear()
+        return jsonify({'success': True, 'deleted': deleted})
 
     except sqlite3.Error as e:
-        print(f"เกิดข้อผิดพลาดในการดึงข้อมูล: {e}")
+        logger.error("เกิดข้อผิดพลาดในการลบข้อมูล: %s", e)
         return jsonify({'error': str(e)}), 500
 
+@lru_cache(maxsize=VIOLATION_CACHE_SIZE)
+def load_violation(violation_id):
+    """
+    ดึงข้อมูลการละเมิดหนึ่งรายการด้วย primary key
+    ข้อมูลไม่เปลี่ยนหลังบันทึกจึง cache ไว้ในหน่วยความจำ กรณีไม่พบจะ raise KeyError และไม่ถูก cache
+    """
+    with sqlite3.connect(DB_PATH) as conn, STAGE_LATENCY.labels(stage='lookup').time():
+        conn.row_factory = sqlite3.Row
+        row = conn.execute('SELECT * FROM violations WHERE id = ?', (violation_id,)).fetchone()
+    if row is None:
+        raise KeyError(violation_id)
+    return dict(row)
+
+@app.route('/violations/<violation_id>', methods=['GET'])
+def get_violation(violation_id):
+    """ดึงข้อมูลการละเมิดพร้อมค่าความแม่นยำด้วย ID"""
+    try:
+        response = jsonify(load_violation(violation_id))
+        response.cache_control.public = True
+        response.cache_control.max_age = 3600
+        return response
+
+    except KeyError:
+        return jsonify({'error': 'ไม่พบข้อมูลการละเมิด'}), 404
+    except sqlite3.Error as e:
+        logger.error("เกิดข้อผิดพลาดในการดึงข้อมูล: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    if request.url_rule is not None and hasattr(g, 'request_start'):
+        REQUEST_LATENCY.labels(request.method, request.url_rule.rule).observe(
+            time.perf_counter() - g.request_start)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics"""
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+# สร้างตารางตอน import เพื่อให้ทำงานได้ทั้งภายใต้ gunicorn และ python database.py
+os.makedirs(os.path.dirname(DB_PATH) or '.', exist_ok=True)
+init_db()
+
 if __name__ == '__main__':
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    init_db()
     app.run(host='0.0.0.0', port=5003)
\ No newline at end of file
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, g
 from ultralytics import YOLO
 import cv2
 import torch
@@ -7,22 +7,83 @@ import redis
 import json
 import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait
 import threading
 import time
-from threading import Event, Lock
-from queue import Queue
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from urllib.parse import quote
+from prometheus_client import Histogram, Counter, generate_latest, CONTENT_TYPE_LATEST
+from streaming import PreviewEncoder
+from jobs import JobRegistry, FINISHED_STATES, QUEUED
+from segments import keyframe_times, plan_segments, seek_to_frame
+from service_logging import setup_logging
+
+logger = setup_logging('detector')
+
+# Prometheus metrics
+STAGE_LATENCY = Histogram(
+    'detector_stage_seconds', 'เวลาที่ใช้ในแต่ละขั้นตอนของการประมวลผลเฟรม', ['stage'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+HOP_LATENCY = Histogram('detector_http_hop_seconds', 'เวลาเรียก service ปลายทาง', ['target'])
+REQUEST_LATENCY = Histogram('detector_request_seconds', 'เวลาตอบคำขอ HTTP', ['method', 'endpoint'])
+FRAMES_PROCESSED = Counter('detector_frames_total', 'จำนวนเฟรมที่ประมวลผลแล้ว')
+VIOLATIONS_DETECTED = Counter('detector_violations_total', 'จำนวนการละเมิดที่ตรวจพบ')
 
 app = Flask(__name__)
 model = None
 redis_client = redis.Redis(host='redis', port=6379)
 
-# ตัวแปรสำหรับจัดการการประมวลผลวิดีโอ
-video_processes = {}
-process_locks = {}
-processing_status = {}
-video_queues = {}
-video_threads = {}
-MAX_QUEUE_SIZE = 10
+# ทะเบียนงานประมวลผลวิดีโอ งานที่สิ้นสุดแล้วจะถูกลบหลัง JOB_TTL_SECONDS
+MAX_RUNNING_JOBS = int(os.getenv('MAX_RUNNING_JOBS', '2'))
+jobs = JobRegistry(
+    ttl=int(os.getenv('JOB_TTL_SECONDS', '3600')),
+    max_running=MAX_RUNNING_JOBS
+)
+
+# วิดีโอที่ยาวกว่า PARALLEL_MIN_SECONDS วินาทีจะถูกแบ่งให้ SEGMENT_WORKERS thread ประมวลผลพร้อมกัน
+PARALLEL_MIN_SECONDS = float(os.getenv('PARALLEL_MIN_SECONDS', '300'))
+SEGMENT_WORKERS = int(os.getenv('SEGMENT_WORKERS', str(min(4, os.cpu_count() or 1))))
+# thread ของ segment worker ใช้ต่อเนื่องข้ามงาน เพื่อไม่ต้องโหลดโมเดลของแต่ละ thread ใหม่ทุกครั้ง
+# แต่ละ thread ถือสำเนาโมเดลของตัวเองไว้ตลอดอายุ process (บน GPU แต่ละสำเนาจอง CUDA memory)
+# จึงจำกัด pool ไว้ที่ SEGMENT_WORKERS thread: มีโมเดลไม่เกิน SEGMENT_WORKERS + 1 ชุด (รวม model หลัก)
+# ช่วงของวิดีโอยาวที่ประมวลผลพร้อมกันหลายไฟล์จะรอคิวใน pool นี้
+segment_pool = ThreadPoolExecutor(max_workers=max(SEGMENT_WORKERS, 1), thread_name_prefix='segment')
+_segment_models = threading.local()
+
+# จำนวน thread ของ torch (intra-op) ทั้งหมดที่ให้โมเดลใช้ torch เก็บค่านี้เป็นค่าเดียวทั้ง process
+# (thread ใหม่ก็ใช้ค่าล่าสุดที่ถูกตั้ง) จึงแบ่งให้เท่ากันตามจำนวน thread ที่กำลังรันโมเดลอยู่
+# แทนการตั้งค่าแยกต่อ worker เพื่อไม่ให้หลาย worker ใช้ทุกคอร์พร้อมกันจนแย่งกันเอง
+TORCH_THREADS = int(os.getenv('TORCH_THREADS', str(torch.get_num_threads())))
+_inference_lock = threading.Lock()
+_inference_active = 0
+
+# การตั้งค่าภาพพรีวิวสำหรับผู้ชม
+PREVIEW_FPS = float(os.getenv('PREVIEW_FPS', '15'))
+PREVIEW_WIDTH = int(os.getenv('PREVIEW_WIDTH', '640'))
+PREVIEW_QUALITY = int(os.getenv('PREVIEW_QUALITY', '80'))
+PREVIEW_MIN_QUALITY = int(os.getenv('PREVIEW_MIN_QUALITY', '40'))
+PREVIEW_MAX_QUALITY = int(os.getenv('PREVIEW_MAX_QUALITY', '90'))
+# ส่งภาพสถานะเมื่อไม่มีเฟรมใหม่นานเกิน N วินาที ต้องน้อยกว่า STREAM_READ_TIMEOUT ของ frontend
+STREAM_KEEPALIVE_SECONDS = float(os.getenv('STREAM_KEEPALIVE_SECONDS', '5'))
+
+PROCESSOR_URL = os.getenv('PROCESSOR_URL', 'http://processor:5002')
+DATABASE_URL = os.getenv('DATABASE_URL', 'http://database:5003')
+VIOLATION_CACHE_SIZE = int(os.getenv('VIOLATION_CACHE_SIZE', '4096'))
+# อายุของข้อมูลการละเมิดใน cache (วินาที) เพื่อไม่ให้คืนข้อมูลที่ถูกลบตามนโยบายเก็บรักษาไปแล้ว
+# 0 = ไม่ cache
+VIOLATION_CACHE_TTL = int(os.getenv('VIOLATION_CACHE_TTL', '300'))
+
+# connection pool แบบ keep-alive สำหรับเรียก processor และ database
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))
+service_session = requests.Session()
+service_session.mount('http://', HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE))
+
+# ส่งการละเมิดไปยัง processor ด้วย thread จำนวนจำกัด แทนการสร้าง thread ใหม่ทุกครั้ง
+processor_pool = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix='send-to-processor')
 
 # สร้างโฟลเดอร์สำหรับเก็บภาพที่ตรวจจับได้
 DETECTION_FOLDER = os.getenv('DETECTION_FOLDER', 'detections')
@@ -32,26 +93,88 @@ def load_model():
     """โหลดโมเดล YOLO สำหรับตรวจจับวัตถุ"""
     global model
     model_path = os.getenv('MODEL_PATH')
-    print(f"กำลังโหลดโมเดลจาก: {model_path}")
+    logger.info("กำลังโหลดโมเดลจาก: %s", model_path)
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"ไม่พบไฟล์โมเดล: {model_path}")
     model = YOLO(model_path)
 
-def save_detection_image(image, filename):
-    """บันทึกภาพที่ตรวจจับได้"""
-    path = os.path.join(DETECTION_FOLDER, filename)
+def detection_image_dir(filename):
+    """
+    โฟลเดอร์ย่อยของภาพการละเมิดจากวิดีโอนี้ แบ่งตามวันที่และชื่อวิดีโอ (YYYY/MM/DD/<video>)
+    เพื่อไม่ให้ไฟล์ทั้งหมดกองอยู่ในโฟลเดอร์เดียว และให้ frontend รวม/ลบภาพเป็นรายวันได้
+    """
+    video_name = os.path.splitext(os.path.basename(filename))[0] or 'video'
+    return os.path.join(datetime.now().strftime('%Y/%m/%d'), video_name)
+
+def save_detection_image(image, relative_path):
+    """บันทึกภาพที่ตรวจจับได้ คืน path สัมพัทธ์กับ DETECTION_FOLDER"""
+    path = os.path.join(DETECTION_FOLDER, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
     cv2.imwrite(path, image)
-    return filename
+    return relative_path
+
+def draw_detections(frame, xyxy, cls, conf):
+    """วาด bounding box และป้ายกำกับลงบนภาพพรีวิว"""
+    for i, box in enumerate(xyxy):
+        x1, y1, x2, y2 = map(int, box)
+        class_id = int(cls[i])
+        color, label = colors.get(class_id, ((128, 128, 128), 'ไม่ทราบ'))
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+
+        # เพิ่มป้ายกำกับ
+        label_text = f'{label} ({conf[i]:.2f})'
+        (text_width, text_height), _ = cv2.getTextSize(
+            label_text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+        cv2.rectangle(
+            frame,
+            (x1, y1 - text_height - 10),
+            (x1 + text_width + 10, y1),
+            color,
+            -1
+        )
+        cv2.putText(
+            frame,
+            label_text,
+            (x1 + 5, y1 - 5),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.6,
+            (255, 255, 255),
+            2
+        )
 
-def send_to_processor(filename, frame_number, detections):
+def draw_status(frame, fps):
+    """แสดงสถานะและ FPS บนภาพพรีวิว"""
+    cv2.putText(
+        frame,
+        'Processing...',
+        (10, 30),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        0.7,
+        (255, 255, 255),
+        2
+    )
+    cv2.putText(
+        frame,
+        f'FPS: {fps:.1f}',
+        (10, 60),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        0.7,
+        (255, 255, 255),
+        2
+    )
+
+def send_to_processor(job, frame_number, detections, images, trace_id):
     """
     ส่งข้อมูลการตรวจจับไปยัง processor service พร้อมค่าความแม่นยำ
     
     Args:
-        filename (str): ชื่อไฟล์วิดีโอ
+        job (Job): งานประมวลผลของวิดีโอ
         frame_number (int): เฟรมที่ตรวจพบการละเมิด
         detections (list): ผลการตรวจจับจาก YOLO model
+        images (tuple): path สัมพัทธ์ของภาพ (รถจักรยานยนต์, ป้ายทะเบียน) ใน DETECTION_FOLDER
+        trace_id (str): รหัสติดตามการละเมิดนี้ตลอดทุก service จนถึงแถวในฐานข้อมูล
     """
+    filename = job.filename
     try:
         # สร้าง dictionary สำหรับเก็บค่า confidence แต่ละประเภท
         confidences = {
@@ -76,330 +199,501 @@ def send_to_processor(filename, frame_number, detections):
         avg_confidence = sum(confidences.values()) / len(confidences)
         detection_id = f"{filename}_frame{frame_number}"
         
-        # บันทึกสถานะการประมวลผล
-        status_data = {
-            'is_processing': True,
-            'confidence': avg_confidence,
-            'motorcycle_conf': confidences['motorcycle'],
-            'no_helmet_conf': confidences['no_helmet'],
-            'plate_conf': confidences['plate']
-        }
-        
-        if filename in processing_status:
-            if isinstance(processing_status[filename], dict):
-                processing_status[filename].update(status_data)
-            else:
-                processing_status[filename] = status_data
-
         # ส่งข้อมูลไปยัง processor
         payload = {
             'id': detection_id,
             'filename': filename,
             'frame_number': frame_number,
-            'motorcycle_image': f"{detection_id}_motorcycle.jpg",
-            'plate_image': f"{detection_id}_plate.jpg",
+            'motorcycle_image': images[0],
+            'plate_image': images[1],
             'confidence': avg_confidence,
             'motorcycle_conf': confidences['motorcycle'],
             'no_helmet_conf': confidences['no_helmet'],
-            'plate_conf': confidences['plate']
+            'plate_conf': confidences['plate'],
+            'trace_id': trace_id
         }
         
-        response = requests.post(
-            'http://processor:5002/process_frame',
-            json=payload,
-            timeout=5
-        )
+        with HOP_LATENCY.labels(target='processor').time():
+            response = service_session.post(
+                f'{PROCESSOR_URL}/process_frame',
+                json=payload,
+                headers={'X-Trace-Id': trace_id},
+                timeout=5
+            )
         
         if response.status_code != 200:
-            print(f"ไม่สามารถส่งข้อมูลไปยัง processor ได้: {response.text}")
+            logger.warning("ไม่สามารถส่งข้อมูลไปยัง processor ได้ (trace %s): %s", trace_id, response.text)
             
     except requests.exceptions.Timeout:
-        print(f"หมดเวลาในการส่งข้อมูลสำหรับเฟรม {frame_number}")
+        logger.warning("หมดเวลาในการส่งข้อมูลสำหรับเฟรม %s (trace %s)", frame_number, trace_id)
     except Exception as e:
-        print(f"เกิดข้อผิดพลาดในการส่งข้อมูล: {e}")
-        print(f"ข้อมูล: filename={filename}, frame={frame_number}")
+        logger.error("เกิดข้อผิดพลาดในการส่งข้อมูล: %s (filename=%s, frame=%s, trace %s)",
+                     e, filename, frame_number, trace_id)
+
+def violation_id_from_image(filename):
+    """แปลงชื่อไฟล์ภาพการละเมิด (<id>_motorcycle.jpg หรือ <id>_plate.jpg) เป็น violation ID"""
+    filename = os.path.basename(filename)
+    for suffix in ('_motorcycle.jpg', '_plate.jpg'):
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+def fetch_violation(violation_id):
+    """
+    ดึงข้อมูลการละเมิดจาก database service ผ่าน cache ที่มีอายุ VIOLATION_CACHE_TTL วินาที
+    กรณีไม่พบจะ raise KeyError และไม่ถูก cache
+    """
+    if VIOLATION_CACHE_TTL <= 0:
+        return load_violation.__wrapped__(violation_id, None)
+    # คีย์ของ cache เปลี่ยนทุก VIOLATION_CACHE_TTL วินาที รายการเก่าจึงไม่ถูกใช้อีกและหลุดออกตาม LRU
+    return load_violation(violation_id, int(time.time() // VIOLATION_CACHE_TTL))
 
-@app.route('/confidence/<filename>', methods=['GET'])
+@lru_cache(maxsize=VIOLATION_CACHE_SIZE)
+def load_violation(violation_id, time_bucket):
+    """ข้อมูลการละเมิดไม่เปลี่ยนหลังบันทึก แต่อาจถูกลบตามนโยบายเก็บรักษา จึง cache ได้เพียงช่วงเวลาหนึ่ง"""
+    with HOP_LATENCY.labels(target='database').time():
+        response = service_session.get(f"{DATABASE_URL}/violations/{quote(violation_id, safe='')}", timeout=2)
+    if response.status_code == 404:
+        raise KeyError(violation_id)
+    response.raise_for_status()
+    return response.json()
+
+@app.route('/confidence/<path:filename>', methods=['GET'])
 def get_confidence(filename):
-    """ดึงค่าความแม่นยำจากการตรวจจับ"""
+    """ดึงค่าความแม่นยำของการละเมิดจากข้อมูลที่บันทึกในฐานข้อมูล"""
+    violation_id = violation_id_from_image(filename)
     try:
-        print(f"กำลังดึงค่าความแม่นยำสำหรับ: {filename}")
-        
-        video_name = filename
-        if '_motorcycle.jpg' in filename:
-            video_name = filename.replace('_motorcycle.jpg', '')
-            if '_frame' in video_name:
-                video_name = video_name.split('_frame')[0]
-        
-        print(f"วิดีโอ: {video_name}")
-        
-        if not video_name in processing_status:
-            print(f"ไม่พบข้อมูลความแม่นยำสำหรับ: {video_name}")
-            processing_status[video_name] = {
-                'confidence': 0.0,
-                'motorcycle_conf': 0.0,
-                'no_helmet_conf': 0.0,
-                'plate_conf': 0.0
-            }
-        
-        result = {
-            'confidence': float(processing_status[video_name].get('confidence', 0.0)),
-            'motorcycle_conf': float(processing_status[video_name].get('motorcycle_conf', 0.0)),
-            'no_helmet_conf': float(processing_status[video_name].get('no_helmet_conf', 0.0)),
-            'plate_conf': float(processing_status[video_name].get('plate_conf', 0.0))
-        }
-        
-        print(f"ค่าความแม่นยำ: {result}")
-        return jsonify(result)
-        
-    except Exception as e:
-        print(f"เกิดข้อผิดพลาดในการดึงค่าความแม่นยำ: {e}")
-        print(f"filename: {filename}")
-        print(f"video_name: {video_name if 'video_name' in locals() else 'ไม่สามารถแยกชื่อวิดีโอได้'}")
-        
+        violation = fetch_violation(violation_id)
         return jsonify({
-            'error': str(e),
-            'confidence': 0.0,
-            'motorcycle_conf': 0.0,
-            'no_helmet_conf': 0.0,
-            'plate_conf': 0.0
-        }), 200
+            'id': violation_id,
+            'confidence': float(violation.get('confidence') or 0.0),
+            'motorcycle_conf': float(violation.get('motorcycle_conf') or 0.0),
+            'no_helmet_conf': float(violation.get('no_helmet_conf') or 0.0),
+            'plate_conf': float(violation.get('plate_conf') or 0.0)
+        })
+
+    except KeyError:
+        # ยังไม่ถูกบันทึก (OCR ยังไม่เสร็จ) หรือไม่มีการละเมิดนี้
+        logger.debug("ไม่พบข้อมูลความแม่นยำสำหรับ: %s", violation_id)
+        error = 'ไม่พบข้อมูลการละเมิด'
+    except Exception as e:
+        logger.error("เกิดข้อผิดพลาดในการดึงค่าความแม่นยำ: %s (filename=%s)", e, filename)
+        error = str(e)
+
+    return jsonify({
+        'error': error,
+        'confidence': 0.0,
+        'motorcycle_conf': 0.0,
+        'no_helmet_conf': 0.0,
+        'plate_conf': 0.0
+    }), 200
 
 @app.route('/stop', methods=['POST'])
 def stop_processing():
-    """หยุดการประมวลผลวิดีโอ"""
+    """หยุดการประมวลผลวิดีโอ ระบุด้วย job_id หรือชื่อไฟล์"""
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
+        job_id = data.get('job_id')
         filename = data.get('filename')
         
-        if not filename:
-            return jsonify({'error': 'ต้องระบุชื่อไฟล์'}), 400
-
-        with process_locks.get(filename, Lock()):
-            if filename in processing_status:
-                processing_status[filename]['is_processing'] = False
-                if filename in video_processes:
-                    video_processes[filename].set()
-                return jsonify({'success': True})
+        if not job_id and not filename:
+            return jsonify({'error': 'ต้องระบุ job_id หรือชื่อไฟล์'}), 400
+
+        job = jobs.get(job_id) if job_id else jobs.active_for(filename)
+        if job is None or job.finished:
             return jsonify({'error': 'ไม่พบการประมวลผลที่กำลังทำงาน'}), 404
 
+        job.cancel()
+        return jsonify({'success': True, 'job': job.to_dict()})
+
     except Exception as e:
-        print(f"เกิดข้อผิดพลาดในการหยุดการประมวลผล: {e}")
+        logger.error("เกิดข้อผิดพลาดในการหยุดการประมวลผล: %s", e)
         return jsonify({'error': str(e)}), 500
 
+def detect_objects(detector_model, frame):
+    """ตรวจจับวัตถุด้วย YOLO (รวม NMS ภายในโมเดล)"""
+    inference_start = time.perf_counter()
+    with torch.inference_mode():
+        results = detector_model(frame, conf=0.6, iou=0.5, max_det=10, agnostic_nms=True)[0]
+    STAGE_LATENCY.labels(stage='inference').observe(time.perf_counter() - inference_start)
+    return results
+
+def record_violation(job, frame, frame_number, results):
+    """
+    ตรวจว่าเฟรมนี้มีการละเมิดครบทุกเงื่อนไขหรือไม่ ถ้ามีจะบันทึกภาพ (ตัดจากภาพต้นฉบับก่อนวาด bounding box)
+
+    Returns:
+        tuple: (frame_number, detections, images) สำหรับ send_to_processor หรือ None ถ้าไม่มีการละเมิด
+    """
+    if len(results.boxes) == 0:
+        return None
+    xyxy = results.boxes.xyxy.cpu().numpy()
+    cls = results.boxes.cls.cpu().numpy()
+
+    # เก็บพิกัดของวัตถุที่ตรวจพบ
+    detections = {
+        'motorcycle': None,
+        'no_helmet': False,
+        'plate': None
+    }
+
+    # วนลูปตรวจสอบวัตถุที่พบ
+    for i, box in enumerate(xyxy):
+        x1, y1, x2, y2 = map(int, box)
+        class_id = int(cls[i])
+
+        # จัดเก็บพิกัดตามประเภท
+        if class_id == 0:  # Motorcycle
+            detections['motorcycle'] = (x1, y1, x2, y2)
+        elif class_id == 3:  # NoHelmet
+            detections['no_helmet'] = True
+        elif class_id == 2:  # LicensePlate
+            detections['plate'] = (x1, y1, x2, y2)
+
+    if not all([detections['motorcycle'], detections['no_helmet'], detections['plate']]):
+        return None
+
+    x1, y1, x2, y2 = detections['motorcycle']
+    motorcycle_img = frame[y1:y2, x1:x2].copy()
+
+    x1, y1, x2, y2 = detections['plate']
+    plate_img = frame[y1:y2, x1:x2].copy()
+
+    filename = job.filename
+    image_prefix = os.path.join(detection_image_dir(filename), f"{filename}_frame{frame_number}")
+    images = (
+        save_detection_image(motorcycle_img, f"{image_prefix}_motorcycle.jpg"),
+        save_detection_image(plate_img, f"{image_prefix}_plate.jpg")
+    )
+    VIOLATIONS_DETECTED.inc()
+    return frame_number, results.boxes.data.tolist(), images
+
+def submit_violation(job, violation):
+    """ส่งการละเมิดให้ processor ผ่าน thread pool (ไม่รอผล)"""
+    frame_number, detections, images = violation
+    processor_pool.submit(send_to_processor, job, frame_number, detections, images, uuid.uuid4().hex)
+
+def use_parallel_segments(frame_count, fps):
+    """วิดีโอที่ยาวกว่า PARALLEL_MIN_SECONDS จะถูกแบ่งเป็นช่วงและประมวลผลพร้อมกัน"""
+    if SEGMENT_WORKERS < 2 or frame_count <= 0 or fps <= 0:
+        return False
+    return frame_count / fps >= PARALLEL_MIN_SECONDS
+
+def process_video_frames(job):
+    """อ่านวิดีโอทีละเฟรม ตรวจจับวัตถุ บันทึกการละเมิด และส่งภาพพรีวิวให้ผู้ชม"""
+    broadcaster = job.broadcaster
+    cap = cv2.VideoCapture(job.video_path)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    job.frames_total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    video_fps = cap.get(cv2.CAP_PROP_FPS)
+    if use_parallel_segments(job.frames_total, video_fps):
+        cap.release()
+        return process_video_segments(job, video_fps)
+
+    frame_count = 0
+    last_frame_time = time.time()
+    preview = PreviewEncoder(
+        broadcaster,
+        fps=PREVIEW_FPS,
+        width=PREVIEW_WIDTH,
+        quality=PREVIEW_QUALITY,
+        min_quality=PREVIEW_MIN_QUALITY,
+        max_quality=PREVIEW_MAX_QUALITY
+    )
+
+    begin_inference()
+    try:
+        while cap.isOpened() and not job.stop_event.is_set():
+            decode_start = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                break
+
+            frame = cv2.resize(frame, (854, 480))
+            STAGE_LATENCY.labels(stage='decode').observe(time.perf_counter() - decode_start)
+
+            results = detect_objects(model, frame)
+            postprocess_start = time.perf_counter()
+
+            violation = record_violation(job, frame, frame_count, results)
+            if violation:
+                submit_violation(job, violation)
+
+            # วาดภาพพรีวิวเฉพาะเมื่อมีผู้ชมและถึงรอบของ preview FPS
+            if preview.is_due():
+                if len(results.boxes) > 0:
+                    boxes = results.boxes
+                    draw_detections(frame, boxes.xyxy.cpu().numpy(), boxes.cls.cpu().numpy(), boxes.conf.cpu().numpy())
+                fps = 1.0 / max(time.time() - last_frame_time, 1e-6)
+                draw_status(frame, fps)
+                encode_start = time.perf_counter()
+                STAGE_LATENCY.labels(stage='postprocess').observe(encode_start - postprocess_start)
+                preview.publish(frame)
+                STAGE_LATENCY.labels(stage='encode').observe(time.perf_counter() - encode_start)
+            else:
+                STAGE_LATENCY.labels(stage='postprocess').observe(time.perf_counter() - postprocess_start)
+
+            # ปรับ frame rate ให้เท่าเวลาจริงเฉพาะเมื่อมีผู้ชม
+            frame_count += 1
+            job.add_frames()
+            FRAMES_PROCESSED.inc()
+            if broadcaster.viewer_count > 0:
+                elapsed_time = time.time() - last_frame_time
+                if elapsed_time < 1/30:  # รักษา FPS ที่ 30
+                    time.sleep(1/30 - elapsed_time)
+            last_frame_time = time.time()
+
+            # ล้าง GPU memory ทุก 30 เฟรม
+            if frame_count % 30 == 0:
+                torch.cuda.empty_cache()
+
+    except Exception as e:
+        logger.error("เกิดข้อผิดพลาดในการประมวลผลเฟรม: %s (job %s)", e, job.id)
+        raise
+    finally:
+        cap.release()
+        end_inference()
+
+def begin_inference():
+    """
+    นับ thread ที่เริ่มรันโมเดล และตั้งจำนวน thread ของ torch เป็น TORCH_THREADS หารด้วยจำนวนนั้น
+    ต้องเรียก end_inference() เมื่อเลิกใช้โมเดล
+    """
+    global _inference_active
+    with _inference_lock:
+        _inference_active += 1
+        torch.set_num_threads(max(1, TORCH_THREADS // _inference_active))
+
+def end_inference():
+    """คืนส่วนแบ่ง thread ให้ thread ที่ยังรันโมเดลอยู่ (เหลืองานเดียวจะได้ TORCH_THREADS เต็ม)"""
+    global _inference_active
+    with _inference_lock:
+        _inference_active -= 1
+        torch.set_num_threads(max(1, TORCH_THREADS // max(_inference_active, 1)))
+
+def segment_model():
+    """โมเดลของ segment worker แต่ละ thread (การ predict ของ YOLO ใช้ร่วมกันข้าม thread ไม่ได้)"""
+    detector_model = getattr(_segment_models, 'model', None)
+    if detector_model is None:
+        detector_model = _segment_models.model = YOLO(os.getenv('MODEL_PATH'))
+    return detector_model
+
+def process_segment(job, segment, preview=None):
+    """
+    ประมวลผลช่วงเฟรม [segment.start, segment.end) ด้วย VideoCapture ของตัวเอง
+    segment.end เป็น None สำหรับช่วงสุดท้าย ซึ่งอ่านจนจบไฟล์
+    """
+    cap = cv2.VideoCapture(job.video_path)
+    begin_inference()
+    try:
+        detector_model = segment_model()
+        frame_number = seek_to_frame(cap, segment.start)
+        last_frame_time = time.time()
+        while (segment.end is None or frame_number < segment.end) and not job.stop_event.is_set():
+            decode_start = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame = cv2.resize(frame, (854, 480))
+            STAGE_LATENCY.labels(stage='decode').observe(time.perf_counter() - decode_start)
+
+            results = detect_objects(detector_model, frame)
+            postprocess_start = time.perf_counter()
+            violation = record_violation(job, frame, frame_number, results)
+            if violation:
+                submit_violation(job, violation)
+
+            if preview is not None and preview.is_due():
+                if len(results.boxes) > 0:
+                    boxes = results.boxes
+                    draw_detections(frame, boxes.xyxy.cpu().numpy(), boxes.cls.cpu().numpy(), boxes.conf.cpu().numpy())
+                fps = 1.0 / max(time.time() - last_frame_time, 1e-6)
+                draw_status(frame, fps)
+                encode_start = time.perf_counter()
+                STAGE_LATENCY.labels(stage='postprocess').observe(encode_start - postprocess_start)
+                preview.publish(frame)
+                STAGE_LATENCY.labels(stage='encode').observe(time.perf_counter() - encode_start)
+            else:
+                STAGE_LATENCY.labels(stage='postprocess').observe(time.perf_counter() - postprocess_start)
+
+            frame_number += 1
+            job.add_frames()
+            FRAMES_PROCESSED.inc()
+            last_frame_time = time.time()
+    finally:
+        cap.release()
+        end_inference()
+
+def process_video_segments(job, video_fps):
+    """
+    แบ่งวิดีโอยาวเป็นช่วงที่ keyframe แล้วประมวลผลแต่ละช่วงพร้อมกัน
+    การละเมิดของแต่ละช่วงถูกส่งให้ processor ทันทีที่พบ (ลำดับในฐานข้อมูลเป็นไปตามเวลาที่บันทึก
+    เช่นเดียวกับการประมวลผลแบบลำดับ ซึ่งส่งผ่าน processor_pool พร้อมกันหลาย thread)
+    ภาพพรีวิวแสดงเฉพาะช่วงแรก
+    """
+    segments = plan_segments(
+        job.frames_total,
+        SEGMENT_WORKERS,
+        fps=video_fps,
+        keyframes=keyframe_times(job.video_path),
+        min_frames=int(video_fps * PARALLEL_MIN_SECONDS / SEGMENT_WORKERS) or 1
+    )
+    logger.info("แบ่ง %s เป็น %d ช่วง: %s (job %s)", job.filename, len(segments),
+                [(s.start, s.end) for s in segments], job.id)
+
+    preview = PreviewEncoder(
+        job.broadcaster,
+        fps=PREVIEW_FPS,
+        width=PREVIEW_WIDTH,
+        quality=PREVIEW_QUALITY,
+        min_quality=PREVIEW_MIN_QUALITY,
+        max_quality=PREVIEW_MAX_QUALITY
+    )
+    futures = [
+        segment_pool.submit(process_segment, job, segment, preview if segment.index == 0 else None)
+        for segment in segments
+    ]
+    try:
+        for future in futures:
+            future.result()
+    except Exception as e:
+        # หยุด segment อื่นเมื่อมีช่วงใดล้มเหลว
+        logger.error("เกิดข้อผิดพลาดในการประมวลผลช่วงวิดีโอ: %s (job %s)", e, job.id)
+        job.stop_event.set()
+        wait(futures)
+        raise
+
+def status_frame(job):
+    """ภาพแจ้งสถานะงาน ใช้แทนภาพพรีวิวเมื่องานยังรอคิวหรือไม่มีเฟรมใหม่"""
+    frame = np.zeros((360, PREVIEW_WIDTH, 3), dtype=np.uint8)
+    if job.state == QUEUED:
+        text = 'Queued, waiting for a free worker...'
+    else:
+        progress = job.frames_done / job.frames_total * 100 if job.frames_total else 0.0
+        text = f'Processing... {progress:.0f}%'
+    cv2.putText(frame, text, (20, 180), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+    return cv2.imencode('.jpg', frame)[1].tobytes()
+
+def stream_response(job):
+    """สร้าง MJPEG response จากบัฟเฟอร์เฟรมของงาน"""
+    def generate_frames():
+        """ฟังก์ชันสร้าง video stream จากบัฟเฟอร์เฟรมที่ใช้ร่วมกัน"""
+        try:
+            # ส่งภาพสถานะเป็นระยะระหว่างรอคิว ไม่ให้ proxy ด้านหน้าตัดการเชื่อมต่อเพราะหมดเวลาอ่าน
+            for frame_data in job.broadcaster.frames(keepalive=STREAM_KEEPALIVE_SECONDS):
+                if frame_data is None:
+                    frame_data = status_frame(job)
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_data + b'\r\n')
+        finally:
+            # ผู้ชมปิดการเชื่อมต่อไม่ได้หยุดการประมวลผล ใช้ /stop แทน
+            logger.debug("ปิด generator สำหรับ %s (job %s)", job.filename, job.id)
+
+    # ส่ง Response แบบ streaming
+    return Response(
+        generate_frames(),
+        mimetype='multipart/x-mixed-replace; boundary=frame',
+        direct_passthrough=True
+    )
+
 @app.route('/process', methods=['GET', 'POST'])
 def process_video():
-    """ประมวลผลวิดีโอและตรวจจับวัตถุ"""
+    """
+    POST เริ่มประมวลผลวิดีโอ (ถ้ายังไม่มีงานที่ทำอยู่)
+    GET ดูสตรีมของงานล่าสุดของวิดีโอเท่านั้น ไม่เริ่มงานใหม่ ป้องกันการประมวลผลซ้ำเมื่อผู้ชมเปิดหน้าใหม่
+    """
     try:
-        # รับพารามิเตอร์
         if request.method == 'GET':
-            video_path = request.args.get('video_path')
             filename = request.args.get('filename')
-        else:
-            data = request.get_json()
-            if not data:
-                return jsonify({'error': 'ไม่พบข้อมูล'}), 400
-            video_path = data.get('video_path')
-            filename = data.get('filename')
+            job = jobs.latest_for(filename) if filename else None
+            if job is None:
+                return jsonify({'error': 'ไม่พบงานประมวลผลของวิดีโอนี้'}), 404
+            return stream_response(job)
+
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'ไม่พบข้อมูล'}), 400
+        video_path = data.get('video_path')
+        filename = data.get('filename')
 
         if not video_path or not os.path.exists(video_path):
             return jsonify({'error': f'ไม่พบไฟล์วิดีโอ: {video_path}'}), 400
 
-        # สร้าง queue สำหรับเก็บเฟรม
-        if filename not in video_queues:
-            video_queues[filename] = Queue(maxsize=MAX_QUEUE_SIZE)
-            processing_status[filename] = {
-                'is_processing': True,
-                'confidence': 0.0,
-                'motorcycle_conf': 0.0,
-                'no_helmet_conf': 0.0,
-                'plate_conf': 0.0
-            }
-
-            def process_video_frames():
-                cap = cv2.VideoCapture(video_path)
-                cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-                frame_count = 0
-                last_frame_time = time.time()
-                
-                try:
-                    while cap.isOpened() and processing_status[filename]['is_processing']:
-                        ret, frame = cap.read()
-                        if not ret:
-                            break
-
-                        frame = cv2.resize(frame, (854, 480))
-                        
-                        # ตรวจจับวัตถุด้วย YOLO
-                        with torch.inference_mode():
-                            results = model(frame, conf=0.6, iou=0.5, max_det=10, agnostic_nms=True)[0]
-                        
-                        if len(results.boxes) > 0:
-                            # เก็บภาพต้นฉบับ
-                            original_frame = frame.copy()
-                            
-                            boxes = results.boxes
-                            xyxy = boxes.xyxy.cpu().numpy()
-                            cls = boxes.cls.cpu().numpy()
-                            conf = boxes.conf.cpu().numpy()
-                            
-                            # เก็บพิกัดของวัตถุที่ตรวจพบ
-                            detections = {
-                                'motorcycle': None,
-                                'no_helmet': False,
-                                'plate': None
-                            }
-                            
-                            # วนลูปตรวจสอบวัตถุที่พบ
-                            for i, box in enumerate(xyxy):
-                                x1, y1, x2, y2 = map(int, box)
-                                class_id = int(cls[i])
-                                confidence = conf[i]
-                                
-                                # จัดเก็บพิกัดตามประเภท
-                                if class_id == 0:  # Motorcycle
-                                    detections['motorcycle'] = (x1, y1, x2, y2)
-                                elif class_id == 3:  # NoHelmet
-                                    detections['no_helmet'] = True
-                                elif class_id == 2:  # LicensePlate
-                                    detections['plate'] = (x1, y1, x2, y2)
-                                
-                                # วาด bounding box
-                                color, label = colors.get(class_id, ((128, 128, 128), 'ไม่ทราบ'))
-                                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                                
-                                # เพิ่มป้ายกำกับ
-                                label_text = f'{label} ({confidence:.2f})'
-                                (text_width, text_height), _ = cv2.getTextSize(
-                                    label_text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-                                cv2.rectangle(
-                                    frame, 
-                                    (x1, y1 - text_height - 10),
-                                    (x1 + text_width + 10, y1),
-                                    color, 
-                                    -1
-                                )
-                                cv2.putText(
-                                    frame,
-                                    label_text,
-                                    (x1 + 5, y1 - 5),
-                                    cv2.FONT_HERSHEY_SIMPLEX,
-                                    0.6,
-                                    (255, 255, 255),
-                                    2
-                                )
-
-                            # บันทึกภาพเมื่อตรวจพบครบทุกเงื่อนไข
-                            if all([detections['motorcycle'], detections['no_helmet'], detections['plate']]):
-                                # ตัดภาพจากภาพต้นฉบับ
-                                x1, y1, x2, y2 = detections['motorcycle']
-                                motorcycle_img = original_frame[y1:y2, x1:x2].copy()
-                                
-                                x1, y1, x2, y2 = detections['plate']
-                                plate_img = original_frame[y1:y2, x1:x2].copy()
-                                
-                                motorcycle_filename = save_detection_image(
-                                    motorcycle_img, f"{filename}_frame{frame_count}_motorcycle.jpg")
-                                plate_filename = save_detection_image(
-                                    plate_img, f"{filename}_frame{frame_count}_plate.jpg")
-                                
-                                threading.Thread(
-                                    target=send_to_processor,
-                                    args=(filename, frame_count, results.boxes.data.tolist()),
-                                    daemon=True
-                                ).start()
-
-                        # แสดงสถานะ
-                        cv2.putText(
-                            frame,
-                            'Processing...',
-                            (10, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            0.7,
-                            (255, 255, 255),
-                            2
-                        )
-
-                        # แสดง FPS
-                        fps = 1.0 / (time.time() - last_frame_time)
-                        cv2.putText(
-                            frame,
-                            f'FPS: {fps:.1f}',
-                            (10, 60),
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            0.7,(255, 255, 255),
-                            2
-                        )
-
-                        # แปลงภาพและเพิ่มลงใน queue
-                        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
-                        frame_data = buffer.tobytes()
-                        
-                        try:
-                            if not video_queues[filename].full():
-                                video_queues[filename].put_nowait(frame_data)
-                            else:
-                                # ถ้า queue เต็ม ให้นำ frame เก่าออกก่อน
-                                video_queues[filename].get_nowait()
-                                video_queues[filename].put_nowait(frame_data)
-                        except:
-                            continue
-
-                        # ปรับ frame rate
-                        frame_count += 1
-                        elapsed_time = time.time() - last_frame_time
-                        if elapsed_time < 1/30:  # รักษา FPS ที่ 30
-                            time.sleep(1/30 - elapsed_time)
-                        last_frame_time = time.time()
-
-                        # ล้าง GPU memory ทุก 30 เฟรม
-                        if frame_count % 30 == 0:
-                            torch.cuda.empty_cache()
-                            
-                except Exception as e:
-                    print(f"เกิดข้อผิดพลาดในการประมวลผลเฟรม: {e}")
-                finally:
-                    cap.release()
-                    processing_status[filename]['is_processing'] = False
-
-            # สร้าง thread สำหรับประมวลผลวิดีโอ
-            process_thread = threading.Thread(target=process_video_frames, daemon=True)
-            video_threads[filename] = process_thread
-            process_thread.start()
-
-        def generate_frames():
-            """ฟังก์ชันสร้าง video stream"""
-            try:
-                while processing_status[filename]['is_processing'] or not video_queues[filename].empty():
-                    try:
-                        frame_data = video_queues[filename].get(timeout=0.1)
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + frame_data + b'\r\n')
-                    except:
-                        continue
-            finally:
-                # ทำความสะอาดทรัพยากรเมื่อ generator ถูกปิด
-                if filename in video_queues:
-                    while not video_queues[filename].empty():
-                        try:
-                            video_queues[filename].get_nowait()
-                        except:
-                            pass
-                if filename in processing_status:
-                    processing_status[filename]['is_processing'] = False
-                print(f"ปิด generator สำหรับ {filename}")
-
-        # ส่ง Response แบบ streaming
-        return Response(
-            generate_frames(),
-            mimetype='multipart/x-mixed-replace; boundary=frame',
-            direct_passthrough=True
-        )
+        # เริ่มงานเพียงครั้งเดียวต่อวิดีโอ ผู้ชมใช้บัฟเฟอร์เฟรมของงานเดิม
+        job, started = jobs.submit(filename, video_path, process_video_frames)
+
+        # POST ใช้สั่งเริ่มงานอย่างเดียว ไม่ผูกการประมวลผลไว้กับการเชื่อมต่อ
+        return jsonify({'success': True, 'filename': filename, 'started': started, 'job': job.to_dict()})
 
     except Exception as e:
-        print(f"เกิดข้อผิดพลาดในการประมวลผลวิดีโอ: {e}")
+        logger.error("เกิดข้อผิดพลาดในการประมวลผลวิดีโอ: %s", e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """รายการงานประมวลผลพร้อมความคืบหน้า กรองด้วย ?state=running ได้"""
+    state = request.args.get('state')
+    return jsonify([
+        job.to_dict() for job in jobs.list()
+        if not state or job.state == state
+    ])
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """สร้างงานประมวลผลวิดีโอ รับ JSON {video_path, filename}"""
+    data = request.get_json(silent=True) or {}
+    video_path = data.get('video_path')
+    filename = data.get('filename') or (os.path.basename(video_path) if video_path else None)
+
+    if not video_path or not os.path.exists(video_path):
+        return jsonify({'error': f'ไม่พบไฟล์วิดีโอ: {video_path}'}), 400
+
+    job, started = jobs.submit(filename, video_path, process_video_frames)
+    return jsonify({'started': started, **job.to_dict()}), 201 if started else 200
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """สถานะและความคืบหน้าของงาน"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'ไม่พบงานนี้'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """ยกเลิกงานที่รอคิวหรือกำลังประมวลผล"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'ไม่พบงานนี้'}), 404
+    if job.state in FINISHED_STATES:
+        return jsonify({'error': f'งานสิ้นสุดแล้ว ({job.state})'}), 409
+    job.cancel()
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/stream', methods=['GET'])
+def stream_job(job_id):
+    """ดูภาพพรีวิวของงาน"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'ไม่พบงานนี้'}), 404
+    return stream_response(job)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    if request.url_rule is not None and hasattr(g, 'request_start'):
+        REQUEST_LATENCY.labels(request.method, request.url_rule.rule).observe(
+            time.perf_counter() - g.request_start)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics"""
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
 # กำหนดสีและชื่อคลาส
 colors = {
     0: ((255, 140, 0), 'Motorcycle'),
@@ -413,4 +707,4 @@ if __name__ == '__main__':
         load_model()
         app.run(host='0.0.0.0', port=5001)
     except Exception as e:
-        print(f"เกิดข้อผิดพลาดในการเริ่มต้นบริการ: {e}")
\ No newline at end of file
+        logger.critical("เกิดข้อผิดพลาดในการเริ่มต้นบริการ: %s", e)
\ No newline at end of file
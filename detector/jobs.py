@@ -0,0 +1,192 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from streaming import FrameBroadcaster
+
+# สถานะของงานประมวลผลวิดีโอ
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class Job:
+    """งานประมวลผลวิดีโอหนึ่งไฟล์ พร้อมสถานะ ความคืบหน้า และบัฟเฟอร์เฟรมสำหรับผู้ชม"""
+
+    def __init__(self, filename, video_path):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.video_path = video_path
+        self.state = QUEUED
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.frames_done = 0
+        self.frames_total = 0
+        self.stop_event = threading.Event()
+        self.broadcaster = FrameBroadcaster()
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def start(self):
+        """เปลี่ยนเป็นสถานะ running คืน False ถ้างานสิ้นสุดไปแล้ว (เช่นถูกยกเลิกระหว่างรอคิว)"""
+        with self._lock:
+            if self.finished:
+                return False
+            self.state = RUNNING
+            self.started_at = time.time()
+            return True
+
+    def finish(self, state, error=None, only_from=None):
+        """
+        เปลี่ยนเป็นสถานะสิ้นสุด (done/failed/cancelled) และปิดบัฟเฟอร์เฟรม
+        ถ้าระบุ only_from จะเปลี่ยนเฉพาะเมื่อสถานะปัจจุบันตรงกัน คืน True ถ้าเปลี่ยนสถานะ
+        """
+        with self._lock:
+            if self.finished or (only_from is not None and self.state != only_from):
+                return False
+            self.state = state
+            self.error = error
+            self.finished_at = time.time()
+        self.broadcaster.close()
+        return True
+
+    def cancel(self):
+        """ขอหยุดงาน งานที่ยังรอคิวจะถูกยกเลิกทันที งานที่กำลังทำจะหยุดที่เฟรมถัดไป"""
+        self.stop_event.set()
+        # ตรวจและเปลี่ยนสถานะภายใต้ lock เดียวกับ start() เพื่อไม่ให้ชนกับงานที่กำลังเริ่ม
+        self.finish(CANCELLED, only_from=QUEUED)
+
+    def add_frames(self, count=1):
+        with self._lock:
+            self.frames_done += count
+
+    @property
+    def fps(self):
+        if not self.started_at or not self.frames_done:
+            return 0.0
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return self.frames_done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """เวลาที่คาดว่าจะเหลือ (วินาที) หรือ None ถ้ายังประเมินไม่ได้"""
+        if self.state != RUNNING or not self.frames_total or not self.fps:
+            return None
+        return max(self.frames_total - self.frames_done, 0) / self.fps
+
+    def to_dict(self):
+        eta = self.eta
+        return {
+            'job_id': self.id,
+            'filename': self.filename,
+            'state': self.state,
+            'error': self.error,
+            'frames_done': self.frames_done,
+            'frames_total': self.frames_total,
+            'progress': self.frames_done / self.frames_total if self.frames_total else 0.0,
+            'fps': round(self.fps, 2),
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'viewers': self.broadcaster.viewer_count,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+class JobRegistry:
+    """
+    ทะเบียนงานประมวลผลวิดีโอ อ้างอิงด้วย job ID
+
+    จำกัดจำนวนงานที่ทำพร้อมกันด้วย max_running งานที่เกินจะอยู่ในสถานะ queued
+    งานที่สิ้นสุดแล้วจะถูกลบออกเมื่อเกิน ttl วินาที เพื่อไม่ให้หน่วยความจำโตตามจำนวนวิดีโอ
+    """
+
+    def __init__(self, ttl=3600, max_running=2):
+        self.ttl = ttl
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_running)
+
+    def submit(self, filename, video_path, target):
+        """
+        สร้างงานใหม่และเริ่ม thread ประมวลผลด้วย target(job)
+        ถ้าวิดีโอนี้มีงานที่ยังไม่สิ้นสุดอยู่แล้วจะคืนงานเดิม
+
+        Returns:
+            tuple: (job, created)
+        """
+        with self._lock:
+            self._evict_expired()
+            job = self._active_for(filename)
+            if job is not None:
+                return job, False
+            job = Job(filename, video_path)
+            self._jobs[job.id] = job
+
+        threading.Thread(target=self._run, args=(job, target), daemon=True).start()
+        return job, True
+
+    def _run(self, job, target):
+        # รอจนกว่าจะมีช่องว่าง หรือถูกยกเลิกระหว่างรอคิว
+        while not self._slots.acquire(timeout=0.5):
+            if job.stop_event.is_set():
+                job.finish(CANCELLED)
+                return
+        try:
+            if job.stop_event.is_set():
+                job.finish(CANCELLED)
+                return
+            if not job.start():
+                return
+            target(job)
+            job.finish(CANCELLED if job.stop_event.is_set() else DONE)
+        except Exception as e:
+            job.finish(FAILED, str(e))
+        finally:
+            self._slots.release()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _active_for(self, filename):
+        for job in reversed(self._jobs.values()):
+            if job.filename == filename and not job.finished:
+                return job
+        return None
+
+    def active_for(self, filename):
+        """งานล่าสุดของวิดีโอที่ยังไม่สิ้นสุด"""
+        with self._lock:
+            return self._active_for(filename)
+
+    def latest_for(self, filename):
+        """งานล่าสุดของวิดีโอ รวมถึงงานที่สิ้นสุดแล้วแต่ยังไม่ถูกลบ"""
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job.filename == filename:
+                    return job
+        return None
+
+    def list(self):
+        with self._lock:
+            self._evict_expired()
+            return list(self._jobs.values())
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,95 @@
+import bisect
+import logging
+import shutil
+import subprocess
+from collections import namedtuple
+
+import cv2
+
+logger = logging.getLogger('detector')
+
+# ช่วงเฟรม [start, end) ของวิดีโอที่ worker หนึ่งตัวรับผิดชอบ end=None คืออ่านจนจบไฟล์
+Segment = namedtuple('Segment', 'index start end')
+
+
+def keyframe_times(video_path, timeout=60):
+    """
+    เวลา (วินาที) ของ keyframe ในวิดีโอ อ่านจาก packet flags ด้วย ffprobe โดยไม่ต้อง decode
+    คืน None ถ้าไม่มี ffprobe หรืออ่านไม่สำเร็จ
+    """
+    if shutil.which('ffprobe') is None:
+        return None
+    try:
+        output = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', video_path],
+            capture_output=True, text=True, timeout=timeout, check=True
+        ).stdout
+    except (subprocess.SubprocessError, OSError) as e:
+        logger.warning("อ่านตำแหน่ง keyframe ไม่สำเร็จ: %s", e)
+        return None
+
+    times = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            times.append(float(pts_time))
+    return sorted(times) or None
+
+
+def plan_segments(frame_count, workers, fps=None, keyframes=None, min_frames=1, max_shift=None):
+    """
+    แบ่งวิดีโอเป็นช่วงเท่า ๆ กันตามจำนวน worker
+    ถ้ามีเวลา keyframe จะเลื่อนจุดแบ่งไปยัง keyframe ที่ใกล้ที่สุด เพื่อให้แต่ละช่วง
+    seek ได้ตรงเฟรมโดยไม่ต้อง decode ย้อนจาก keyframe ก่อนหน้า แต่เลื่อนไม่เกิน max_shift เฟรม
+    (ค่าเริ่มต้นคือหนึ่งในสี่ของความยาวช่วง) ถ้า keyframe อยู่ไกลกว่านั้นจะใช้จุดแบ่งเดิม
+
+    frame_count เป็นค่าประมาณจาก container ช่วงสุดท้ายจึงมี end=None ให้อ่านจนจบไฟล์จริง
+
+    Returns:
+        list: Segment เรียงตามลำดับเฟรม
+    """
+    if frame_count <= 0:
+        return []
+    workers = max(1, min(workers, frame_count // max(min_frames, 1) or 1))
+    if max_shift is None:
+        max_shift = frame_count // (workers * 4)
+
+    candidates = None
+    if keyframes and fps:
+        candidates = sorted({int(round(t * fps)) for t in keyframes if 0 < t * fps < frame_count})
+
+    boundaries = [0]
+    for i in range(1, workers):
+        boundary = frame_count * i // workers
+        if candidates:
+            # keyframe ที่ใกล้จุดแบ่งที่ต้องการที่สุด
+            pos = bisect.bisect_left(candidates, boundary)
+            nearby = candidates[max(pos - 1, 0):pos + 1]
+            nearest = min(nearby, key=lambda frame: abs(frame - boundary))
+            if abs(nearest - boundary) <= max_shift:
+                boundary = nearest
+        if boundary - boundaries[-1] >= min_frames and frame_count - boundary >= min_frames:
+            boundaries.append(boundary)
+    boundaries.append(None)
+
+    return [Segment(i, start, end) for i, (start, end) in enumerate(zip(boundaries, boundaries[1:]))]
+
+
+def seek_to_frame(cap, frame_number):
+    """
+    เลื่อน VideoCapture ไปยังเฟรมที่ต้องการ คืนหมายเลขเฟรมที่จะอ่านได้ถัดไป
+    ถ้า backend seek ได้ไม่ถึง จะอ่านทิ้ง (grab) จนถึงเฟรมนั้น
+    """
+    if frame_number <= 0:
+        return 0
+    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+    position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if position > frame_number:
+        # seek เลยไป เริ่มจากต้นไฟล์แทนเพื่อให้หมายเลขเฟรมถูกต้อง
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        position = 0
+    while position < frame_number and cap.grab():
+        position += 1
+    return position
+
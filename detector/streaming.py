@@ -0,0 +1,171 @@
+import threading
+import time
+
+import cv2
+
+# ใช้ libjpeg-turbo ผ่าน PyTurboJPEG ถ้าติดตั้งไว้ ไม่เช่นนั้นใช้ cv2.imencode
+# (opencv-python wheel ก็ลิงก์กับ libjpeg-turbo อยู่แล้ว)
+try:
+    from turbojpeg import TurboJPEG
+    turbo_jpeg = TurboJPEG()
+except Exception:
+    turbo_jpeg = None
+
+
+class FrameBroadcaster:
+    """
+    บัฟเฟอร์เฟรมล่าสุดของวิดีโอหนึ่งรายการ สำหรับส่งให้ผู้ชมหลายคนพร้อมกัน
+
+    เก็บเฉพาะภาพ JPEG ล่าสุดพร้อมหมายเลขลำดับ (sequence number)
+    ผู้ชมแต่ละคนจำหมายเลขลำดับที่อ่านไปแล้วและรอเฟรมถัดไปเอง
+    การอ่านไม่ดึงเฟรมออกจากบัฟเฟอร์และไม่คัดลอกข้อมูล (bytes เป็น immutable)
+    จึงเข้ารหัสภาพเพียงครั้งเดียวต่อเฟรมไม่ว่าจะมีผู้ชมกี่คน
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._sequence = 0
+        self._closed = False
+        self._viewers = 0
+        self._delivered = 0
+        self._skipped = 0
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def sequence(self):
+        return self._sequence
+
+    @property
+    def viewer_count(self):
+        return self._viewers
+
+    def consume_stats(self):
+        """คืนจำนวนเฟรมที่ส่งถึงผู้ชมและจำนวนเฟรมที่ผู้ชมอ่านไม่ทัน ตั้งแต่การเรียกครั้งก่อน"""
+        with self._condition:
+            stats = (self._delivered, self._skipped)
+            self._delivered = 0
+            self._skipped = 0
+            return stats
+
+    def publish(self, frame_data):
+        """เผยแพร่เฟรม JPEG ใหม่และปลุกผู้ชมทุกคนที่รออยู่"""
+        with self._condition:
+            self._frame = frame_data
+            self._sequence += 1
+            self._condition.notify_all()
+
+    def close(self):
+        """ปิดบัฟเฟอร์เมื่อการประมวลผลสิ้นสุด ผู้ชมจะได้รับเฟรมสุดท้ายแล้วออกจากลูป"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def wait_for_frame(self, last_sequence, timeout=0.5):
+        """
+        รอเฟรมที่ใหม่กว่า last_sequence
+
+        Returns:
+            tuple: (sequence, frame_data) หรือ (last_sequence, None) ถ้าไม่มีเฟรมใหม่ภายใน timeout
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._sequence != last_sequence or self._closed,
+                timeout=timeout
+            )
+            if self._sequence == last_sequence:
+                return last_sequence, None
+            return self._sequence, self._frame
+
+    def frames(self, timeout=0.5, keepalive=None):
+        """
+        Generator ส่งเฟรมใหม่ทุกเฟรมให้ผู้ชมหนึ่งคนจนกว่าบัฟเฟอร์จะถูกปิด
+        ถ้ากำหนด keepalive จะ yield None เมื่อไม่มีเฟรมใหม่นานเกิน keepalive วินาที
+        (เช่น งานยังรอคิว) เพื่อให้ผู้เรียกส่งภาพแทนและการเชื่อมต่อไม่หมดเวลา
+        """
+        with self._condition:
+            self._viewers += 1
+        try:
+            sequence = 0
+            last_yield = time.monotonic()
+            while True:
+                previous = sequence
+                sequence, frame_data = self.wait_for_frame(sequence, timeout)
+                if frame_data is not None:
+                    with self._condition:
+                        self._delivered += 1
+                        if previous:
+                            self._skipped += max(0, sequence - previous - 1)
+                    last_yield = time.monotonic()
+                    yield frame_data
+                elif self._closed:
+                    return
+                elif keepalive and time.monotonic() - last_yield >= keepalive:
+                    last_yield = time.monotonic()
+                    yield None
+        finally:
+            with self._condition:
+                self._viewers -= 1
+
+
+class PreviewEncoder:
+    """
+    เข้ารหัสภาพพรีวิวเฉพาะเมื่อมีผู้ชม โดยจำกัด FPS และความกว้างของภาพ
+
+    คุณภาพ JPEG ปรับตามอัตราที่ผู้ชมอ่านเฟรมทัน: ถ้าผู้ชมข้ามเฟรมมากจะลดคุณภาพ
+    ถ้าอ่านทันทุกเฟรมจะค่อย ๆ เพิ่มคุณภาพกลับขึ้นไป
+    """
+
+    ADAPT_INTERVAL = 1.0
+    DROP_THRESHOLD = 0.2
+
+    def __init__(self, broadcaster, fps=15, width=640, quality=80, min_quality=40, max_quality=90):
+        self.broadcaster = broadcaster
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.width = width
+        self.quality = quality
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self._last_publish = 0.0
+        self._last_adapt = time.time()
+
+    def is_due(self):
+        """ตรวจสอบว่าควรสร้างภาพพรีวิวสำหรับเฟรมนี้หรือไม่"""
+        if self.broadcaster.viewer_count == 0:
+            return False
+        return time.time() - self._last_publish >= self.interval
+
+    def publish(self, frame):
+        """ย่อขนาด เข้ารหัส และเผยแพร่ภาพพรีวิว"""
+        height, width = frame.shape[:2]
+        if self.width and width > self.width:
+            frame = cv2.resize(frame, (self.width, int(height * self.width / width)),
+                               interpolation=cv2.INTER_AREA)
+
+        if turbo_jpeg is not None:
+            frame_data = turbo_jpeg.encode(frame, quality=self.quality)
+        else:
+            _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            frame_data = buffer.tobytes()
+
+        self.broadcaster.publish(frame_data)
+        self._last_publish = time.time()
+        self._adapt_quality()
+
+    def _adapt_quality(self):
+        now = time.time()
+        if now - self._last_adapt < self.ADAPT_INTERVAL:
+            return
+        self._last_adapt = now
+
+        delivered, skipped = self.broadcaster.consume_stats()
+        total = delivered + skipped
+        if total == 0:
+            return
+        if skipped / total > self.DROP_THRESHOLD:
+            self.quality = max(self.min_quality, self.quality - 10)
+        elif skipped == 0:
+            self.quality = min(self.max_quality, self.quality + 5)
@@ -1,9 +1,23 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, Response
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, redirect, g
 import cv2
 import os
 import time
+import threading
 import requests
+from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib.parse import quote
 from werkzeug.utils import secure_filename
+from prometheus_client import Histogram, generate_latest, CONTENT_TYPE_LATEST
+from uploads import UploadStore, UploadError, save_and_hash
+from storage import DetectionStorage
+from service_logging import setup_logging
+
+logger = setup_logging('frontend')
+
+# Prometheus metrics
+HOP_LATENCY = Histogram('frontend_http_hop_seconds', 'เวลาเรียก service ปลายทาง', ['target'])
+REQUEST_LATENCY = Histogram('frontend_request_seconds', 'เวลาตอบคำขอ HTTP', ['method', 'endpoint'])
 
 app = Flask(__name__)
 
@@ -12,58 +26,227 @@ app.config.update(
     UPLOAD_FOLDER=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads'),
     DETECTION_FOLDER=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'detections'),
     MAX_CONTENT_LENGTH=2 * 1024 * 1024 * 1024,  # 2GB max-size
-    STREAM_CHUNK_SIZE=1024 * 1024  # 1MB chunks for streaming
+    MAX_UPLOAD_SIZE=2 * 1024 * 1024 * 1024,  # 2GB max-size สำหรับการอัปโหลดแบบแบ่งส่วน
+    UPLOAD_CHUNK_SIZE=8 * 1024 * 1024,  # 8MB ต่อส่วนที่แนะนำให้ client ส่ง
+    # ลบการอัปโหลดที่ไม่มีข้อมูลเข้ามาเกิน N วินาที และเก็บผลการอัปโหลดที่เสร็จแล้วไว้ N วินาที
+    UPLOAD_TTL=int(os.getenv('UPLOAD_TTL', str(24 * 3600))),
+    UPLOAD_RESULT_TTL=int(os.getenv('UPLOAD_RESULT_TTL', '3600')),
+    STREAM_CHUNK_SIZE=1024 * 1024,  # 1MB chunks for streaming
+    DETECTOR_URL=os.getenv('DETECTOR_URL', 'http://detector:5001'),
+    PROCESSOR_URL=os.getenv('PROCESSOR_URL', 'http://processor:5002'),
+    DATABASE_URL=os.getenv('DATABASE_URL', 'http://database:5003'),
+    # URL ของ detector ที่เบราว์เซอร์เข้าถึงได้โดยตรง ถ้ากำหนดไว้จะ redirect แทนการ proxy
+    DETECTOR_PUBLIC_URL=os.getenv('DETECTOR_PUBLIC_URL', ''),
+    STREAM_CONNECT_TIMEOUT=float(os.getenv('STREAM_CONNECT_TIMEOUT', '3')),
+    STREAM_READ_TIMEOUT=float(os.getenv('STREAM_READ_TIMEOUT', '30')),
+    STREAM_POOL_SIZE=int(os.getenv('STREAM_POOL_SIZE', '32')),
+    # ภาพที่ตรวจจับได้ไม่เปลี่ยนแปลงหลังบันทึก จึงให้เบราว์เซอร์ cache ได้นาน
+    DETECTION_CACHE_MAX_AGE=int(os.getenv('DETECTION_CACHE_MAX_AGE', str(7 * 24 * 3600))),
+    # ให้ web server ด้านหน้า (Apache mod_xsendfile) ส่งไฟล์แทน Flask
+    USE_X_SENDFILE=os.getenv('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes'),
+    # prefix ของ internal location ใน nginx สำหรับ X-Accel-Redirect เช่น /protected-detections/
+    X_ACCEL_REDIRECT_PREFIX=os.getenv('X_ACCEL_REDIRECT_PREFIX', ''),
+    # รวมภาพที่เก่ากว่า N วันเป็นไฟล์ archive รายวัน (0 = ไม่รวม)
+    DETECTION_PACK_AFTER_DAYS=int(os.getenv('DETECTION_PACK_AFTER_DAYS', '2')),
+    # ลบภาพและข้อมูลการละเมิดที่เก่ากว่า N วัน (0 = เก็บไว้ตลอด)
+    DETECTION_RETENTION_DAYS=int(os.getenv('DETECTION_RETENTION_DAYS', '0')),
+    STORAGE_MAINTENANCE_INTERVAL=float(os.getenv('STORAGE_MAINTENANCE_INTERVAL', '3600')),
+    VIOLATIONS_PAGE_SIZE=int(os.getenv('VIOLATIONS_PAGE_SIZE', '100'))
 )
 
+# connection pool แบบ keep-alive สำหรับเรียก detector/processor ใช้ร่วมกันทุกคำขอ
+service_session = requests.Session()
+service_session.mount('http://', HTTPAdapter(
+    pool_connections=2,
+    pool_maxsize=app.config['STREAM_POOL_SIZE']
+))
+
 # Ensure upload and detection directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['DETECTION_FOLDER'], exist_ok=True)
 
+upload_store = UploadStore(
+    app.config['UPLOAD_FOLDER'],
+    app.config['MAX_UPLOAD_SIZE'],
+    ttl=app.config['UPLOAD_TTL'],
+    result_ttl=app.config['UPLOAD_RESULT_TTL']
+)
+detection_storage = DetectionStorage(
+    app.config['DETECTION_FOLDER'],
+    pack_after_days=app.config['DETECTION_PACK_AFTER_DAYS'],
+    retention_days=app.config['DETECTION_RETENTION_DAYS']
+)
+
+def run_storage_maintenance():
+    """
+    รวมภาพเก่าเป็น archive และลบข้อมูลที่เกินระยะเก็บรักษาทั้งในโฟลเดอร์และฐานข้อมูล
+    พร้อมลบการอัปโหลดที่ถูกทิ้งไว้
+    """
+    while True:
+        try:
+            removed = upload_store.sweep()
+            if removed:
+                logger.info("ลบการอัปโหลดที่ค้างไว้ %d รายการ", removed)
+        except Exception as e:
+            logger.warning("ลบการอัปโหลดที่ค้างไว้ไม่สำเร็จ: %s", e)
+        try:
+            result = detection_storage.maintain()
+            if result and result['cutoff'] is not None:
+                with HOP_LATENCY.labels(target='database').time():
+                    response = service_session.delete(
+                        f"{app.config['DATABASE_URL']}/violations",
+                        params={'before': result['cutoff'].isoformat()},
+                        timeout=30
+                    )
+                response.raise_for_status()
+                result['deleted_violations'] = response.json().get('deleted', 0)
+            if result and (result['packed_images'] or result['deleted_days']):
+                logger.info("จัดการพื้นที่เก็บภาพ: %s", result)
+        except Exception as e:
+            logger.warning("จัดการพื้นที่เก็บภาพไม่สำเร็จ: %s", e)
+        time.sleep(app.config['STORAGE_MAINTENANCE_INTERVAL'])
+
+if app.config['STORAGE_MAINTENANCE_INTERVAL'] > 0:
+    threading.Thread(target=run_storage_maintenance, daemon=True, name='storage-maintenance').start()
+
+def enqueue_processing(filename):
+    """สั่ง detector service ให้เริ่มประมวลผลวิดีโอ (ไม่รอผลการประมวลผล)"""
+    video_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    try:
+        with HOP_LATENCY.labels(target='detector').time():
+            response = service_session.post(
+                f"{app.config['DETECTOR_URL']}/process",
+                json={
+                    'video_path': video_path,
+                    'filename': filename
+                },
+                timeout=5
+            )
+        if response.status_code != 200:
+            logger.warning("ไม่สามารถเริ่มการประมวลผลได้: %s", response.text)
+            return None
+        return response.json()
+    except Exception as e:
+        logger.warning("ไม่สามารถติดต่อ detector service ได้: %s", e)
+        return None
+
+def has_violations(filename):
+    """วิดีโอนี้มีผลการตรวจในฐานข้อมูลหรือไม่ คืน None ถ้าติดต่อฐานข้อมูลไม่ได้"""
+    try:
+        with HOP_LATENCY.labels(target='database').time():
+            response = service_session.get(
+                f"{app.config['DATABASE_URL']}/violations",
+                params={'video_name': filename, 'limit': 1},
+                timeout=5
+            )
+        response.raise_for_status()
+        return len(response.json()) > 0
+    except Exception as e:
+        logger.warning("ไม่สามารถตรวจผลการตรวจของ %s ได้: %s", filename, e)
+        return None
+
+def finish_upload(filename, duplicate, sha256):
+    """
+    สร้างผลลัพธ์การอัปโหลดที่เสร็จสมบูรณ์ และสั่งประมวลผลเฉพาะวิดีโอที่ยังไม่เคยถูกประมวลผล
+    ไฟล์ซ้ำจะถูกสั่งประมวลผลอีกครั้งถ้าครั้งก่อน detector ไม่ได้รับงาน หรือยังไม่มีผลการตรวจ
+    (detector คืนงานเดิมถ้างานของวิดีโอนี้ยังทำอยู่)
+    """
+    already_processed = (duplicate and upload_store.is_processed(sha256)
+                         and has_violations(filename) is not False)
+    if already_processed:
+        logger.info("พบวิดีโอเนื้อหาเดียวกันแล้ว ข้ามการประมวลผล: %s", filename)
+        job = None
+    else:
+        if duplicate:
+            logger.info("พบวิดีโอเนื้อหาเดียวกันแต่ยังไม่มีผลการตรวจ สั่งประมวลผลอีกครั้ง: %s", filename)
+        else:
+            logger.info("บันทึกวิดีโอที่: %s", os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        job = enqueue_processing(filename)
+        if job:
+            upload_store.mark_processed(sha256)
+
+    return {
+        'success': True,
+        'complete': True,
+        'filename': filename,
+        'video_path': os.path.join(app.config['UPLOAD_FOLDER'], filename),
+        'duplicate': duplicate,
+        # ไฟล์ซ้ำที่มีผลการตรวจแล้ว หน้าเว็บแสดงผลเดิมแทนสตรีม
+        'already_processed': already_processed,
+        # หน้าเว็บใช้ job_id เพื่อดูสตรีมของงานนี้ ไฟล์ซ้ำไม่มีงานใหม่ให้ดู
+        'job_id': job['job']['job_id'] if job and job.get('job') else None,
+        'job': job
+    }
+
+def upload_error_response(e):
+    return jsonify({'error': str(e), **e.details}), e.status_code
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', page_size=app.config['VIOLATIONS_PAGE_SIZE'])
 
-@app.route('/video_feed/<filename>')
-def video_feed(filename):
+@app.route('/jobs/<job_id>/stream')
+def job_stream(job_id):
     """
-    แสดงวิดีโอสตรีมพร้อม bounding box
+    แสดงวิดีโอสตรีมพร้อม bounding box ของงานที่สร้างไว้แล้ว
+    การดูสตรีมไม่เริ่มงานใหม่ งานถูกสร้างครั้งเดียวตอนอัปโหลดเสร็จ
     """
     try:
-        video_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if not os.path.exists(video_path):
-            return jsonify({'error': 'ไม่พบไฟล์วิดีโอ'}), 404
+        if not job_id.isalnum():
+            return jsonify({'error': 'job_id ไม่ถูกต้อง'}), 400
+
+        # ให้เบราว์เซอร์ดึงสตรีมจาก detector โดยตรง frontend ไม่ต้องคัดลอกข้อมูล
+        if app.config['DETECTOR_PUBLIC_URL']:
+            return redirect(f"{app.config['DETECTOR_PUBLIC_URL']}/jobs/{job_id}/stream", code=307)
 
         # เรียกใช้ detector service ผ่าน API แบบ streaming
         try:
-            response = requests.get(
-                'http://detector:5001/process',
-                params={
-                    'video_path': video_path,
-                    'filename': filename
-                },
-                stream=True
-            )
+            # วัดเฉพาะเวลาจนได้ header ของสตรีม
+            with HOP_LATENCY.labels(target='detector').time():
+                response = service_session.get(
+                    f"{app.config['DETECTOR_URL']}/jobs/{job_id}/stream",
+                    stream=True,
+                    timeout=(app.config['STREAM_CONNECT_TIMEOUT'], app.config['STREAM_READ_TIMEOUT'])
+                )
             
             if response.status_code == 200:
+                def proxy_stream():
+                    try:
+                        # chunk_size=None ส่งต่อข้อมูลทันทีที่ได้รับ ไม่สะสมไว้ในหน่วยความจำ
+                        for chunk in response.iter_content(chunk_size=None):
+                            yield chunk
+                    except requests.exceptions.RequestException as e:
+                        logger.info("สตรีมจาก detector ถูกตัด: %s", e)
+                    finally:
+                        # คืน connection ให้ pool เมื่อผู้ชมปิดการเชื่อมต่อ
+                        response.close()
+
                 return Response(
-                    response.iter_content(chunk_size=None),
-                    mimetype='multipart/x-mixed-replace; boundary=frame'
+                    proxy_stream(),
+                    mimetype='multipart/x-mixed-replace; boundary=frame',
+                    direct_passthrough=True
                 )
             else:
-                return jsonify({'error': f'Detector service error: {response.text}'}), 500
+                error_text = response.text
+                status_code = response.status_code
+                response.close()
+                if status_code == 404:
+                    return jsonify({'error': 'ไม่พบงานประมวลผลนี้'}), 404
+                return jsonify({'error': f'Detector service error: {error_text}'}), 500
                 
         except requests.exceptions.RequestException as e:
-            print(f"ไม่สามารถเชื่อมต่อกับ detector service: {e}")
+            logger.error("ไม่สามารถเชื่อมต่อกับ detector service: %s", e)
             return jsonify({'error': 'ไม่สามารถเชื่อมต่อกับระบบประมวลผลวิดีโอได้'}), 503
 
     except Exception as e:
-        print(f"เกิดข้อผิดพลาดในการแสดงวิดีโอ: {e}")
+        logger.error("เกิดข้อผิดพลาดในการแสดงวิดีโอ: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/upload', methods=['POST'])
 def upload_video():
     """
-    รับไฟล์วิดีโอและเริ่มประมวลผล
+    รับไฟล์วิดีโอทั้งไฟล์ในคำขอเดียว (multipart) และเริ่มประมวลผล
+    สำหรับไฟล์ขนาดใหญ่ให้ใช้ /uploads ซึ่งอัปโหลดต่อได้เมื่อการเชื่อมต่อขาด
     """
     if 'video' not in request.files:
         return jsonify({'error': 'กรุณาเลือกไฟล์วิดีโอ'}), 400
@@ -74,84 +257,167 @@ def upload_video():
     
     try:    
         filename = secure_filename(video.filename)
-        video_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        video.save(video_path)
-        
-        print(f"บันทึกวิดีโอที่: {video_path}")
-        
-        # แจ้ง detector service เพื่อเริ่มประมวลผล
-        try:
-            response = requests.post(
-                'http://detector:5001/process',
-                json={
-                    'video_path': video_path,
-                    'filename': filename
-                },
-                timeout=2
-            )
-            
-            if response.status_code != 200:
-                print(f"Warning: ไม่สามารถเริ่มการประมวลผลได้: {response.text}")
-                
-        except Exception as e:
-            print(f"Warning: ไม่สามารถติดต่อ detector service ได้: {e}")
-        
-        return jsonify({
-            'success': True,
-            'filename': filename,
-            'video_path': video_path
-        })
+        temp_path = os.path.join(upload_store.partial_folder, f"{time.time_ns()}_{filename}")
+        sha256 = save_and_hash(video.stream, temp_path)
+        filename, duplicate = upload_store.store(temp_path, filename, sha256)
+        return jsonify(finish_upload(filename, duplicate, sha256))
         
     except Exception as e:
-        print(f"เกิดข้อผิดพลาดในการอัปโหลด: {str(e)}")
+        logger.error("เกิดข้อผิดพลาดในการอัปโหลด: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """
+    เริ่มการอัปโหลดแบบแบ่งส่วน
+    รับ JSON {filename, size} และคืน upload_id สำหรับส่งข้อมูลแต่ละส่วน
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        status = upload_store.create(data.get('filename'), int(data.get('size', 0)))
+        status['chunk_size'] = app.config['UPLOAD_CHUNK_SIZE']
+        return jsonify(status), 201
+    except UploadError as e:
+        return upload_error_response(e)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'ขนาดไฟล์ไม่ถูกต้อง'}), 400
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """คืนจำนวนไบต์ที่ได้รับแล้ว เพื่อให้ client อัปโหลดต่อจากตำแหน่งนั้น"""
+    try:
+        return jsonify(upload_store.status(upload_id))
+    except UploadError as e:
+        return upload_error_response(e)
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """
+    รับข้อมูลหนึ่งส่วนเป็น raw body และเขียนต่อท้ายไฟล์โดยตรง
+    header Upload-Offset ระบุตำแหน่งเริ่มต้นของข้อมูลส่วนนี้
+    """
+    try:
+        offset = int(request.headers.get('Upload-Offset', '-1'))
+    except ValueError:
+        return jsonify({'error': 'Upload-Offset ไม่ถูกต้อง'}), 400
+
+    try:
+        status = upload_store.append(upload_id, offset, request.stream)
+        if 'sha256' not in status:
+            return jsonify({'success': True, 'complete': False, **status})
+
+        filename, duplicate = upload_store.complete(upload_id, status['sha256'])
+        result = finish_upload(filename, duplicate, status['sha256'])
+        # client ที่ไม่ได้รับคำตอบนี้จะได้ผลเดียวกันจาก GET /uploads/<upload_id>
+        upload_store.record_result(upload_id, result)
+        return jsonify(result)
+
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        logger.error("เกิดข้อผิดพลาดในการอัปโหลด: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/detections/<filename>', methods=['GET'])
-def get_detection(filename):
-    detection_folder = app.config['DETECTION_FOLDER']
-    file_path = os.path.join(detection_folder, filename)
-    if os.path.exists(file_path):
-        return send_from_directory(detection_folder, filename)
+def detection_image_response(name):
+    """ส่งภาพการละเมิดจากไฟล์แยกหรือจาก archive รายวัน"""
+    max_age = app.config['DETECTION_CACHE_MAX_AGE']
+    if detection_storage.loose_path(name):
+        if app.config['X_ACCEL_REDIRECT_PREFIX']:
+            # ให้ nginx ส่งไฟล์เอง Flask ตอบเฉพาะ header
+            response = Response(mimetype='image/jpeg')
+            response.headers['X-Accel-Redirect'] = app.config['X_ACCEL_REDIRECT_PREFIX'] + name
+        else:
+            response = send_from_directory(app.config['DETECTION_FOLDER'], name, max_age=max_age)
     else:
-        return jsonify({'error': 'File not found'}), 404
+        data = detection_storage.read_packed(name)
+        if data is None:
+            return jsonify({'error': 'File not found'}), 404
+        response = Response(data, mimetype='image/jpeg')
+    response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+    return response
+
+def fetch_violation(violation_id):
+    with HOP_LATENCY.labels(target='database').time():
+        response = service_session.get(
+            f"{app.config['DATABASE_URL']}/violations/{quote(violation_id, safe='')}", timeout=5)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+@app.route('/detections/<path:name>', methods=['GET'])
+def get_detection(name):
+    return detection_image_response(name)
+
+@app.route('/api/violations/<violation_id>/<kind>', methods=['GET'])
+def get_violation_image(violation_id, kind):
+    """ภาพของการละเมิดตาม ID (kind = motorcycle หรือ plate)"""
+    if kind not in ('motorcycle', 'plate'):
+        return jsonify({'error': 'ประเภทภาพไม่ถูกต้อง'}), 404
+    try:
+        violation = fetch_violation(violation_id)
+    except Exception as e:
+        logger.error("Error fetching violation %s: %s", violation_id, e)
+        return jsonify({'error': 'ไม่สามารถติดต่อฐานข้อมูลได้'}), 502
+    if not violation or not violation.get(f'{kind}_image'):
+        return jsonify({'error': 'ไม่พบข้อมูลการละเมิด'}), 404
+    return detection_image_response(violation[f'{kind}_image'])
 
 @app.route('/api/violations', methods=['GET'])
 def get_violations():
-    detection_folder = app.config['DETECTION_FOLDER']
+    """
+    รายการการละเมิดล่าสุดจากฐานข้อมูล แบ่งหน้าด้วย ?limit=&offset= กรองตามวิดีโอด้วย ?video=
+    จำนวนทั้งหมดส่งต่อจากฐานข้อมูลใน header X-Total-Count
+    """
+    limit = min(request.args.get('limit', app.config['VIOLATIONS_PAGE_SIZE'], type=int),
+                app.config['VIOLATIONS_PAGE_SIZE'])
+    offset = request.args.get('offset', 0, type=int)
+    try:
+        with HOP_LATENCY.labels(target='database').time():
+            response = service_session.get(
+                f"{app.config['DATABASE_URL']}/violations",
+                params={
+                    'limit': max(limit, 0),
+                    'offset': max(offset, 0),
+                    'video_name': request.args.get('video') or None
+                },
+                timeout=5
+            )
+        response.raise_for_status()
+    except Exception as e:
+        logger.error("Error fetching violations: %s", e)
+        return jsonify({'error': 'ไม่สามารถดึงข้อมูลการละเมิดได้'}), 502
+
     violations = []
+    for row in response.json():
+        violations.append({
+            'id': row['id'],
+            'motorcycle_image': row.get('motorcycle_image'),
+            'plate_image': row.get('plate_image'),
+            'license_plate_text': row.get('license_plate_text') or 'รอการตรวจสอบ',
+            'confidence': row.get('confidence') or 0.0,
+            'timestamp': datetime.fromisoformat(row['timestamp']).isoformat()
+        })
+    headers = {}
+    if 'X-Total-Count' in response.headers:
+        headers['X-Total-Count'] = response.headers['X-Total-Count']
+    return jsonify(violations), 200, headers
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    if request.url_rule is not None and hasattr(g, 'request_start'):
+        REQUEST_LATENCY.labels(request.method, request.url_rule.rule).observe(
+            time.perf_counter() - g.request_start)
+    return response
 
-    # อ่านไฟล์ในโฟลเดอร์ detections
-    for filename in os.listdir(detection_folder):
-        if filename.endswith('_motorcycle.jpg'):  # ตรวจสอบภาพมอเตอร์ไซค์
-            plate_image = filename.replace('_motorcycle.jpg', '_plate.jpg')
-            if os.path.exists(os.path.join(detection_folder, plate_image)):
-                # เรียก processor.py เพื่อดึงข้อมูลป้ายทะเบียน
-                license_plate_text = 'รอการตรวจสอบ'
-                try:
-                    response = requests.get(f'http://processor:5002/ocr/{plate_image}', timeout=5)
-                    if response.status_code == 200:
-                        license_plate_text = response.json().get('license_plate', 'รอการตรวจสอบ')
-                except Exception as e:
-                    print(f"Error fetching license plate text: {e}")
-
-                # เรียก detector.py เพื่อดึงค่า confidence
-                confidence = 0.0
-                try:
-                    detection_response = requests.get(f'http://detector:5001/confidence/{filename}', timeout=5)
-                    if detection_response.status_code == 200:
-                        confidence = detection_response.json().get('confidence', 0.0)
-                except Exception as e:
-                    print(f"Error fetching confidence: {e}")
-
-                violations.append({
-                    'motorcycle_image': filename,
-                    'plate_image': plate_image,
-                    'license_plate_text': license_plate_text,  # ข้อมูลจาก processor.py
-                    'confidence': confidence,  # ข้อมูลจาก detector.py
-                    'timestamp': time.ctime(os.path.getmtime(os.path.join(detection_folder, filename)))
-                })
-
-    return jsonify(violations)
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics"""
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,211 @@
+import fcntl
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+from werkzeug.utils import safe_join
+
+PACK_SUFFIX = '.pack'
+INDEX_SUFFIX = '.idx'
+
+
+class DetectionStorage:
+    """
+    จัดการภาพการละเมิดที่ detector บันทึกไว้ แบ่งเป็นสองชั้นตามอายุ
+
+    ภาพใหม่เป็นไฟล์แยกในโฟลเดอร์ย่อยรายวัน เมื่อเก่ากว่า pack_after_days วัน
+    จะถูกรวมเป็นไฟล์ archive เดียวต่อวัน (เขียนต่อท้ายอย่างเดียว) พร้อม index ของ offset
+    แล้วลบไฟล์แยกทิ้ง จำนวนไฟล์และโฟลเดอร์จึงโตตามจำนวนวันแทนจำนวนภาพ
+    ข้อมูลที่เก่ากว่า retention_days วันจะถูกลบทั้งวัน
+
+    โครงสร้างไฟล์:
+        <root>/YYYY/MM/DD/<video>/<id>_motorcycle.jpg   ภาพที่ยังไม่ถูกรวม
+        <root>/YYYY/MM/DD.pack                          ข้อมูลภาพของวันนั้นต่อกัน
+        <root>/YYYY/MM/DD.idx                           {"<video>/<ไฟล์>": [offset, length]}
+
+    ภาพที่บันทึกก่อนมีการแบ่งโฟลเดอร์ (อยู่ที่ <root> โดยตรง) ยังอ่านได้ตามเดิมแต่ไม่ถูกรวมหรือลบ
+    """
+
+    def __init__(self, root, pack_after_days=2, retention_days=0):
+        self.root = root
+        self.pack_after_days = pack_after_days
+        self.retention_days = retention_days
+        os.makedirs(root, exist_ok=True)
+
+    def loose_path(self, name):
+        """path ของภาพที่ยังเป็นไฟล์แยก หรือ None ถ้าไม่มี/ชื่อไม่ปลอดภัย"""
+        path = safe_join(self.root, name)
+        if path is None or not os.path.isfile(path):
+            return None
+        return path
+
+    def read_packed(self, name):
+        """อ่านภาพจากไฟล์ archive รายวัน คืน bytes หรือ None ถ้าไม่พบ"""
+        parts = name.split('/', 3)
+        if len(parts) != 4 or not all(part.isdigit() for part in parts[:3]):
+            return None
+        pack_base = safe_join(self.root, *parts[:3])
+        if pack_base is None:
+            return None
+
+        index = self._index(pack_base + INDEX_SUFFIX)
+        entry = index.get(parts[3])
+        if entry is None:
+            return None
+        offset, length = entry
+        with open(pack_base + PACK_SUFFIX, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def _index(self, index_path):
+        try:
+            mtime = os.stat(index_path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        return _load_index(index_path, mtime)
+
+    def _days(self):
+        """
+        วันทั้งหมดที่มีข้อมูล {date: day_base} โดย day_base คือ <root>/YYYY/MM/DD
+        อ่านเฉพาะโฟลเดอร์ปี/เดือน จึงไม่ต้อง scan ไฟล์ภาพทั้งหมด
+        """
+        days = {}
+        for year in _numeric_entries(self.root):
+            for month in _numeric_entries(year.path):
+                with os.scandir(month.path) as entries:
+                    for entry in entries:
+                        day = entry.name
+                        if day.endswith(INDEX_SUFFIX):
+                            day = day[:-len(INDEX_SUFFIX)]
+                        elif not entry.is_dir():
+                            continue
+                        try:
+                            key = date(int(year.name), int(month.name), int(day))
+                        except ValueError:
+                            continue
+                        days[key] = os.path.join(month.path, day)
+        return days
+
+    def pack_day(self, day_base):
+        """
+        รวมไฟล์ภาพแยกของวันหนึ่งต่อท้าย <day>.pack และอัปเดต <day>.idx แล้วลบไฟล์แยก
+        ถ้าหยุดกลางคัน ข้อมูลที่เขียนต่อท้ายแล้วแต่ไม่อยู่ใน index จะถูกข้ามไป ไฟล์แยกยังอยู่ครบ
+
+        Returns:
+            int: จำนวนภาพที่ถูกรวม
+        """
+        if not os.path.isdir(day_base):
+            return 0
+
+        names = []
+        for dirpath, _, filenames in os.walk(day_base):
+            for filename in filenames:
+                names.append(os.path.relpath(os.path.join(dirpath, filename), day_base).replace(os.sep, '/'))
+        if not names:
+            _remove_tree(day_base)
+            return 0
+
+        index_path = day_base + INDEX_SUFFIX
+        index = dict(self._index(index_path))
+        with open(day_base + PACK_SUFFIX, 'ab') as pack:
+            for name in sorted(names):
+                with open(os.path.join(day_base, name), 'rb') as f:
+                    data = f.read()
+                index[name] = [pack.tell(), len(data)]
+                pack.write(data)
+                # ให้ greenlet อื่นทำงานได้ระหว่างรวมไฟล์ (gunicorn gevent worker)
+                time.sleep(0)
+            pack.flush()
+            os.fsync(pack.fileno())
+
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, index_path)
+
+        _remove_tree(day_base)
+        return len(names)
+
+    def delete_day(self, day_base):
+        _remove_tree(day_base)
+        for suffix in (PACK_SUFFIX, INDEX_SUFFIX):
+            try:
+                os.remove(day_base + suffix)
+            except FileNotFoundError:
+                pass
+
+        # ลบโฟลเดอร์เดือน/ปีที่ว่างแล้ว
+        for parent in (os.path.dirname(day_base), os.path.dirname(os.path.dirname(day_base))):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+
+    def retention_cutoff(self, today=None):
+        """เวลาที่ข้อมูลก่อนหน้านั้นต้องถูกลบ หรือ None ถ้าเก็บไว้ตลอด"""
+        if not self.retention_days:
+            return None
+        today = today or date.today()
+        return datetime.combine(today - timedelta(days=self.retention_days), datetime.min.time())
+
+    def maintain(self, today=None):
+        """
+        รวมภาพของวันที่เก่ากว่า pack_after_days และลบวันที่เก่ากว่า retention_days
+        ใช้ file lock เพื่อให้ทำงานเพียง process เดียวเมื่อมีหลาย worker
+
+        Returns:
+            dict: {'packed_images', 'deleted_days', 'cutoff'} หรือ None ถ้ามี process อื่นทำอยู่
+        """
+        today = today or date.today()
+        with open(os.path.join(self.root, '.maintenance.lock'), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+
+            cutoff = self.retention_cutoff(today)
+            packed, deleted = 0, 0
+            for day, day_base in sorted(self._days().items()):
+                if cutoff is not None and day < cutoff.date():
+                    self.delete_day(day_base)
+                    deleted += 1
+                elif self.pack_after_days and day < today - timedelta(days=self.pack_after_days):
+                    packed += self.pack_day(day_base)
+            return {'packed_images': packed, 'deleted_days': deleted, 'cutoff': cutoff}
+
+
+@lru_cache(maxsize=64)
+def _load_index(index_path, mtime):
+    # mtime เป็นส่วนหนึ่งของ key เพื่อให้อ่านใหม่เมื่อ index ถูกเขียนทับ
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def _remove_tree(path):
+    """
+    ลบโฟลเดอร์ทีละไฟล์จากล่างขึ้นบน แทน shutil.rmtree ที่ลบทั้งต้นไม้ในการเรียกเดียว
+    เพื่อให้ greenlet อื่นทำงานได้ระหว่างลบภาพจำนวนมาก (gunicorn gevent worker)
+    """
+    for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+        for filename in filenames:
+            try:
+                os.remove(os.path.join(dirpath, filename))
+            except FileNotFoundError:
+                pass
+            time.sleep(0)
+        try:
+            os.rmdir(dirpath)
+        except OSError:
+            pass
+
+
+def _numeric_entries(path):
+    try:
+        with os.scandir(path) as entries:
+            return [entry for entry in entries if entry.is_dir() and entry.name.isdigit()]
+    except FileNotFoundError:
+        return []
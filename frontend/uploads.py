@@ -0,0 +1,335 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from werkzeug.utils import secure_filename
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    """ข้อผิดพลาดของการอัปโหลด พร้อม HTTP status ที่ควรตอบกลับ"""
+
+    def __init__(self, message, status_code=400, **details):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+
+class UploadStore:
+    """
+    จัดการการอัปโหลดวิดีโอแบบแบ่งส่วนและอัปโหลดต่อได้ (resumable)
+
+    ข้อมูลแต่ละส่วนถูกเขียนลงไฟล์ .part ใน uploads volume โดยตรงพร้อมคำนวณ SHA-256
+    ไปพร้อมกัน เมื่อได้รับครบจะตรวจสอบ index ของ hash เพื่อข้ามไฟล์ที่เคยอัปโหลดแล้ว
+
+    การอัปโหลดที่ไม่มีข้อมูลเข้ามาเกิน ttl วินาทีจะถูกลบโดย sweep() ส่วนผลของการอัปโหลด
+    ที่เสร็จแล้วจะเก็บไว้ result_ttl วินาที เพื่อให้ client ที่ไม่ได้รับคำตอบของส่วนสุดท้าย
+    ถามสถานะแล้วได้ผลจริงแทน 404
+
+    โครงสร้างไฟล์:
+        <upload_folder>/.partial/<upload_id>.part   ข้อมูลที่ได้รับแล้ว
+        <upload_folder>/.partial/<upload_id>.json   ชื่อไฟล์และขนาดทั้งหมด
+        <upload_folder>/.partial/<upload_id>.done   ผลของการอัปโหลดที่เสร็จแล้ว
+        <upload_folder>/.index/<sha256>             ชื่อไฟล์วิดีโอที่มีเนื้อหานี้ และสร้างงานประมวลผลแล้วหรือไม่
+    """
+
+    def __init__(self, upload_folder, max_size, ttl=24 * 3600, result_ttl=3600):
+        self.upload_folder = upload_folder
+        self.max_size = max_size
+        self.ttl = ttl
+        self.result_ttl = result_ttl
+        self.partial_folder = os.path.join(upload_folder, '.partial')
+        self.index_folder = os.path.join(upload_folder, '.index')
+        os.makedirs(self.partial_folder, exist_ok=True)
+        os.makedirs(self.index_folder, exist_ok=True)
+
+        # สถานะ hash ระหว่างอัปโหลด {upload_id: (offset, hasher)}
+        # ถ้าไม่มี (เช่น service ถูก restart) จะคำนวณใหม่จากไฟล์ .part
+        self._hashers = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.partial_folder, f"{upload_id}.part")
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.partial_folder, f"{upload_id}.json")
+
+    def _done_path(self, upload_id):
+        return os.path.join(self.partial_folder, f"{upload_id}.done")
+
+    def _upload_lock(self, upload_id):
+        with self._lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def _load_meta(self, upload_id):
+        # upload_id มาจาก URL จึงต้องเป็น hex ของ uuid เท่านั้น
+        if not upload_id.isalnum():
+            raise UploadError('upload_id ไม่ถูกต้อง', 400)
+        try:
+            with open(self._meta_path(upload_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadError('ไม่พบการอัปโหลดนี้', 404)
+
+    def _hasher_at(self, upload_id, offset):
+        """คืน hasher ที่ประมวลผลข้อมูลถึง offset แล้ว"""
+        state = self._hashers.get(upload_id)
+        if state and state[0] == offset:
+            return state[1]
+
+        hasher = hashlib.sha256()
+        with open(self._part_path(upload_id), 'rb') as f:
+            remaining = offset
+            while remaining > 0:
+                block = f.read(min(READ_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                hasher.update(block)
+                remaining -= len(block)
+                # ไฟล์อาจใหญ่หลาย GB ให้ greenlet อื่นทำงานได้ระหว่างคำนวณ (gunicorn gevent worker)
+                time.sleep(0)
+        return hasher
+
+    def create(self, filename, size):
+        """เริ่มการอัปโหลดใหม่และคืนสถานะเริ่มต้น"""
+        filename = secure_filename(filename or '')
+        if not filename:
+            raise UploadError('ไม่ได้เลือกไฟล์', 400)
+        if size <= 0 or size > self.max_size:
+            raise UploadError('ขนาดไฟล์ไม่ถูกต้อง', 413 if size > 0 else 400)
+
+        upload_id = uuid.uuid4().hex
+        with open(self._meta_path(upload_id), 'w') as f:
+            json.dump({'filename': filename, 'size': size}, f)
+        open(self._part_path(upload_id), 'wb').close()
+        self._hashers[upload_id] = (0, hashlib.sha256())
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        """
+        คืนจำนวนไบต์ที่ได้รับแล้ว เพื่อให้ client อัปโหลดต่อจากตำแหน่งนั้น
+        ถ้าอัปโหลดเสร็จแล้วจะคืนผลที่บันทึกไว้ (complete=True)
+        """
+        if not upload_id.isalnum():
+            raise UploadError('upload_id ไม่ถูกต้อง', 400)
+        try:
+            with open(self._done_path(upload_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+
+        meta = self._load_meta(upload_id)
+        return {
+            'upload_id': upload_id,
+            'filename': meta['filename'],
+            'size': meta['size'],
+            'received': os.path.getsize(self._part_path(upload_id))
+        }
+
+    def append(self, upload_id, offset, stream):
+        """
+        เขียนข้อมูลจาก stream ต่อท้ายไฟล์ .part ที่ตำแหน่ง offset
+
+        Returns:
+            dict: สถานะการอัปโหลด และ 'sha256' เมื่อได้รับข้อมูลครบ
+        """
+        with self._upload_lock(upload_id):
+            meta = self._load_meta(upload_id)
+            part_path = self._part_path(upload_id)
+            received = os.path.getsize(part_path)
+            if offset != received:
+                raise UploadError('ตำแหน่งข้อมูลไม่ตรงกับที่ได้รับแล้ว', 409, received=received)
+
+            hasher = self._hasher_at(upload_id, received)
+            try:
+                with open(part_path, 'ab') as f:
+                    while True:
+                        block = stream.read(READ_BLOCK_SIZE)
+                        if not block:
+                            break
+                        if received + len(block) > meta['size']:
+                            raise UploadError('ข้อมูลเกินขนาดไฟล์ที่แจ้งไว้', 400, received=received)
+                        f.write(block)
+                        hasher.update(block)
+                        received += len(block)
+            finally:
+                # เก็บสถานะ hash ไว้แม้การเชื่อมต่อขาดกลางคัน เพื่ออัปโหลดต่อได้ทันที
+                self._hashers[upload_id] = (received, hasher)
+
+            result = {
+                'upload_id': upload_id,
+                'filename': meta['filename'],
+                'size': meta['size'],
+                'received': received
+            }
+            if received == meta['size']:
+                result['sha256'] = hasher.hexdigest()
+            return result
+
+    def complete(self, upload_id, sha256):
+        """
+        ย้ายไฟล์ที่อัปโหลดครบแล้วไปยัง uploads folder
+
+        Returns:
+            tuple: (filename, duplicate) ชื่อไฟล์วิดีโอ และเป็นไฟล์ที่เคยอัปโหลดแล้วหรือไม่
+        """
+        with self._upload_lock(upload_id):
+            meta = self._load_meta(upload_id)
+            filename, duplicate = self.store(self._part_path(upload_id), meta['filename'], sha256)
+            # บันทึกผลก่อนลบ metadata เพื่อไม่ให้มีช่วงที่ถามสถานะแล้วได้ 404
+            self.record_result(upload_id, {
+                'success': True,
+                'complete': True,
+                'filename': filename,
+                'duplicate': duplicate
+            })
+            self._discard(upload_id)
+            return filename, duplicate
+
+    def record_result(self, upload_id, result):
+        """บันทึก (หรืออัปเดต) ผลของการอัปโหลดที่เสร็จแล้ว ให้ status() คืนค่านี้"""
+        tmp_path = self._done_path(upload_id) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'upload_id': upload_id, **result}, f)
+        os.replace(tmp_path, self._done_path(upload_id))
+
+    def sweep(self, now=None):
+        """
+        ลบการอัปโหลดที่ค้างไว้เกิน ttl และผลการอัปโหลดที่เก่ากว่า result_ttl
+
+        Returns:
+            int: จำนวนการอัปโหลด/ไฟล์ที่ถูกลบ
+        """
+        now = now or time.time()
+        removed = 0
+        with os.scandir(self.partial_folder) as entries:
+            entries = list(entries)
+        for entry in entries:
+            name, ext = os.path.splitext(entry.name)
+            try:
+                age = now - entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+
+            if ext == '.done':
+                if age > self.result_ttl:
+                    self._remove(entry.path)
+                    removed += 1
+            elif ext == '.json':
+                # อายุนับจากข้อมูลล่าสุดที่เขียนลง .part
+                try:
+                    age = now - os.path.getmtime(self._part_path(name))
+                except FileNotFoundError:
+                    pass
+                if age > self.ttl:
+                    lock = self._upload_lock(name)
+                    if lock.acquire(blocking=False):
+                        try:
+                            self._discard(name)
+                        finally:
+                            lock.release()
+                        removed += 1
+            elif age > self.ttl and not os.path.exists(self._meta_path(name)):
+                # .part ที่ไม่มี metadata หรือไฟล์ชั่วคราวของ /upload ที่ค้างไว้
+                self._remove(entry.path)
+                removed += 1
+
+        with self._lock:
+            for upload_id in list(self._hashers):
+                if not os.path.exists(self._meta_path(upload_id)):
+                    self._hashers.pop(upload_id, None)
+            for upload_id in list(self._locks):
+                if not os.path.exists(self._meta_path(upload_id)) and not self._locks[upload_id].locked():
+                    self._locks.pop(upload_id, None)
+        return removed
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def store(self, source_path, filename, sha256):
+        """ย้ายไฟล์เข้า uploads folder หรือลบทิ้งถ้ามีไฟล์เนื้อหาเดียวกันอยู่แล้ว"""
+        index_path = self._index_path(sha256)
+        with self._lock:
+            entry = self._lookup(index_path)
+            if entry:
+                os.remove(source_path)
+                return entry['filename'], True
+
+            # ชื่อซ้ำแต่เนื้อหาต่างกัน ให้เติม hash ต่อท้ายชื่อ
+            if os.path.exists(os.path.join(self.upload_folder, filename)):
+                stem, ext = os.path.splitext(filename)
+                filename = f"{stem}_{sha256[:12]}{ext}"
+
+            os.replace(source_path, os.path.join(self.upload_folder, filename))
+            # ยังไม่นับว่าประมวลผลแล้ว จนกว่า detector จะรับงาน (mark_processed)
+            self._write_index(index_path, {'filename': filename, 'processed': False})
+            return filename, False
+
+    def is_processed(self, sha256):
+        """เคยสร้างงานประมวลผลให้วิดีโอเนื้อหานี้สำเร็จแล้วหรือไม่"""
+        with self._lock:
+            entry = self._lookup(self._index_path(sha256))
+        return bool(entry and entry['processed'])
+
+    def mark_processed(self, sha256):
+        """บันทึกว่า detector รับงานของวิดีโอเนื้อหานี้แล้ว"""
+        index_path = self._index_path(sha256)
+        with self._lock:
+            entry = self._lookup(index_path)
+            if entry and not entry['processed']:
+                self._write_index(index_path, {'filename': entry['filename'], 'processed': True})
+
+    def _index_path(self, sha256):
+        return os.path.join(self.index_folder, sha256)
+
+    def _write_index(self, index_path, entry):
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, index_path)
+
+    def _lookup(self, index_path):
+        try:
+            with open(index_path) as f:
+                content = f.read().strip()
+        except FileNotFoundError:
+            return None
+        try:
+            entry = json.loads(content)
+        except ValueError:
+            # index แบบเดิมเก็บเพียงชื่อไฟล์ ถือว่าประมวลผลแล้ว (ถ้าไม่มีผลการตรวจจะถูกสั่งประมวลผลใหม่)
+            entry = {'filename': content, 'processed': True}
+        if entry.get('filename') and os.path.exists(os.path.join(self.upload_folder, entry['filename'])):
+            return entry
+        return None
+
+    def _discard(self, upload_id):
+        self._hashers.pop(upload_id, None)
+        for path in (self._part_path(upload_id), self._meta_path(upload_id)):
+            if os.path.exists(path):
+                os.remove(path)
+        with self._lock:
+            self._locks.pop(upload_id, None)
+
+
+def save_and_hash(source, path):
+    """
+    เขียนข้อมูลจาก file object ลง path พร้อมคำนวณ SHA-256 ในรอบเดียว
+    แทนการบันทึกแล้วอ่านไฟล์ซ้ำเพื่อคำนวณ hash
+    """
+    hasher = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for block in iter(lambda: source.read(READ_BLOCK_SIZE), b''):
+            f.write(block)
+            hasher.update(block)
+            # ไฟล์ที่ werkzeug พักไว้บนดิสก์อ่านแบบ blocking ให้ greenlet อื่นทำงานได้ระหว่างคัดลอก
+            time.sleep(0)
+    return hasher.hexdigest()
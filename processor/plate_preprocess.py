@@ -0,0 +1,198 @@
+"""
+License plate preprocessing variants for OCR.
+
+Every plate crop is summarised by a few cheap whole-image statistics
+(size, brightness, contrast, sharpness, skew). The statistics pick the
+preprocessing variant and, when the pre-check is enabled, decide whether
+OCR is worth running at all:
+
+    baseline  blur + adaptive threshold + opening, downscaled to 300px wide
+    upscale   small plates are enlarged before thresholding
+    clahe     low-contrast plates get local histogram equalisation
+    deskew    tilted plates are rotated level before thresholding
+
+All operations are whole-array OpenCV/NumPy calls, no per-pixel Python.
+"""
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+VARIANTS = ('baseline', 'upscale', 'clahe', 'deskew')
+
+DEFAULT_THRESHOLDS = {
+    # pre-check bounds, only used when the pre-check is enabled (it is off by
+    # default). None of these values has been validated against OCR accuracy
+    # yet; tune them with benchmarks/ocr_preprocess.py on a labeled set before
+    # turning the pre-check on. The size check is additionally disabled (0).
+    'min_width': 0,
+    'min_height': 0,
+    'min_contrast': 12.0,
+    'min_sharpness': 15.0,
+    'min_brightness': 25.0,
+    'max_brightness': 235.0,
+    # variant selection
+    'upscale_below_width': 160,
+    'clahe_below_contrast': 40.0,
+    'deskew_above_degrees': 3.0
+}
+
+TARGET_WIDTH = 300
+SKEW_SAMPLE_WIDTH = 160
+
+PlateStats = namedtuple('PlateStats', 'width height brightness contrast sharpness skew')
+
+
+class UnreadablePlate(Exception):
+    """The pre-check predicts OCR would fail on this crop; `reason` says why."""
+
+    def __init__(self, reason, stats=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.stats = stats
+
+
+def to_gray(img):
+    if img is None or img.size == 0:
+        raise UnreadablePlate('empty')
+    if img.ndim == 2:
+        return img
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def estimate_skew(gray):
+    """Angle in degrees of the dominant text line, from the min-area rectangle of dark pixels."""
+    height, width = gray.shape
+    if width > SKEW_SAMPLE_WIDTH:
+        # ประมาณมุมจากภาพย่อก็พอ ไม่ต้องใช้ทุกพิกเซล
+        gray = cv2.resize(gray, (SKEW_SAMPLE_WIDTH, max(1, height * SKEW_SAMPLE_WIDTH // width)),
+                          interpolation=cv2.INTER_AREA)
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    points = cv2.findNonZero(mask)
+    if points is None or len(points) < 10:
+        return 0.0
+    (_, _), (rect_width, rect_height), angle = cv2.minAreaRect(points)
+    # angle is the rotation of the rect_width side; the angle range differs between
+    # OpenCV versions, so take the long side and fold it into (-90, 90]
+    if rect_width < rect_height:
+        angle += 90.0
+    angle = (angle + 90.0) % 180.0 - 90.0
+    return float(angle)
+
+
+def plate_stats(gray):
+    height, width = gray.shape
+    mean, std = cv2.meanStdDev(gray)
+    sharpness = cv2.Laplacian(gray, cv2.CV_32F).var()
+    return PlateStats(
+        width=width,
+        height=height,
+        brightness=float(mean[0][0]),
+        contrast=float(std[0][0]),
+        sharpness=float(sharpness),
+        skew=estimate_skew(gray)
+    )
+
+
+def check_readable(stats, thresholds=DEFAULT_THRESHOLDS):
+    """Return None if OCR is worth running, otherwise the reason it is predicted to fail."""
+    if stats.width < thresholds['min_width'] or stats.height < thresholds['min_height']:
+        return 'too_small'
+    if stats.brightness < thresholds['min_brightness']:
+        return 'too_dark'
+    if stats.brightness > thresholds['max_brightness']:
+        return 'too_bright'
+    if stats.contrast < thresholds['min_contrast']:
+        return 'low_contrast'
+    if stats.sharpness < thresholds['min_sharpness']:
+        return 'blurry'
+    return None
+
+
+def select_variant(stats, thresholds=DEFAULT_THRESHOLDS):
+    if stats.width < thresholds['upscale_below_width']:
+        return 'upscale'
+    if abs(stats.skew) > thresholds['deskew_above_degrees']:
+        return 'deskew'
+    if stats.contrast < thresholds['clahe_below_contrast']:
+        return 'clahe'
+    return 'baseline'
+
+
+def _binarize(gray):
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    thresh = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                   cv2.THRESH_BINARY_INV, 11, 2)
+    return cv2.morphologyEx(thresh, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8), iterations=1)
+
+
+def _fit_width(img, width=TARGET_WIDTH, interpolation=cv2.INTER_AREA):
+    height = max(1, round(img.shape[0] * width / img.shape[1]))
+    return cv2.resize(img, (width, height), interpolation=interpolation)
+
+
+def baseline(gray, stats):
+    binary = _binarize(gray)
+    if binary.shape[1] > TARGET_WIDTH:
+        binary = _fit_width(binary)
+    return binary
+
+
+def upscale(gray, stats):
+    # ขยายก่อน threshold เพื่อไม่ให้ตัวอักษรเล็ก ๆ ถูก opening ลบหายไป
+    return _binarize(_fit_width(gray, interpolation=cv2.INTER_CUBIC))
+
+
+def clahe(gray, stats):
+    equalized = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(4, 8)).apply(gray)
+    return baseline(equalized, stats)
+
+
+def deskew(gray, stats):
+    height, width = gray.shape
+    matrix = cv2.getRotationMatrix2D((width / 2.0, height / 2.0), stats.skew, 1.0)
+    level = cv2.warpAffine(gray, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                           borderMode=cv2.BORDER_REPLICATE)
+    return baseline(level, stats)
+
+
+VARIANT_FUNCTIONS = {
+    'baseline': baseline,
+    'upscale': upscale,
+    'clahe': clahe,
+    'deskew': deskew
+}
+
+
+class PlatePreprocessor:
+    """
+    Pre-check a plate crop and apply the selected (or a fixed) variant.
+
+    variant='auto' picks a variant from the crop statistics; any name in
+    VARIANTS forces that variant. precheck=True skips OCR on crops that
+    fail check_readable(); by default every crop is sent to OCR.
+    """
+
+    def __init__(self, variant='auto', precheck=False, thresholds=None):
+        if variant != 'auto' and variant not in VARIANT_FUNCTIONS:
+            raise ValueError(f'unknown preprocessing variant: {variant}')
+        self.variant = variant
+        self.precheck = precheck
+        self.thresholds = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+
+    def prepare(self, img):
+        """
+        Returns:
+            tuple: (processed image, variant name, PlateStats)
+
+        Raises:
+            UnreadablePlate: when the pre-check predicts OCR would fail
+        """
+        gray = to_gray(img)
+        stats = plate_stats(gray)
+        if self.precheck:
+            reason = check_readable(stats, self.thresholds)
+            if reason:
+                raise UnreadablePlate(reason, stats)
+        variant = select_variant(stats, self.thresholds) if self.variant == 'auto' else self.variant
+        return VARIANT_FUNCTIONS[variant](gray, stats), variant, stats
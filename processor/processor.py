@@ -1,56 +1,81 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g
 import cv2
 import numpy as np
 import easyocr
+from werkzeug.utils import safe_join
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import uuid
 from datetime import datetime
 import threading
+import time
+from prometheus_client import Histogram, Counter, generate_latest, CONTENT_TYPE_LATEST
+from plate_preprocess import PlatePreprocessor, UnreadablePlate
+from service_logging import setup_logging
+
+logger = setup_logging('processor')
+
+# Prometheus metrics
+STAGE_LATENCY = Histogram('processor_stage_seconds', 'Time spent per processing stage', ['stage'])
+HOP_LATENCY = Histogram('processor_http_hop_seconds', 'Latency of calls to downstream services', ['target'])
+REQUEST_LATENCY = Histogram('processor_request_seconds', 'HTTP request latency', ['method', 'endpoint'])
+OCR_VARIANTS = Counter('processor_ocr_variant_total', 'Plates sent to OCR per preprocessing variant', ['variant'])
+OCR_SKIPPED = Counter('processor_ocr_skipped_total', 'Plates not sent to OCR because the pre-check predicted failure', ['reason'])
 
 app = Flask(__name__)
 reader = easyocr.Reader(['th', 'en'])
 
+DATABASE_URL = os.getenv('DATABASE_URL', 'http://database:5003')
+
+# Preprocessing variant: auto (chosen per plate from image statistics) or baseline/upscale/clahe/deskew
+plate_preprocessor = PlatePreprocessor(
+    variant=os.getenv('OCR_PREPROCESS_VARIANT', 'auto'),
+    # ปิด pre-check ไว้จนกว่าจะตั้งเกณฑ์จากชุดภาพที่มีป้ายกำกับจริง (benchmarks/ocr_preprocess.py)
+    precheck=os.getenv('OCR_PRECHECK', 'false').lower() in ('1', 'true', 'yes'),
+    thresholds={
+        'min_sharpness': float(os.getenv('OCR_MIN_SHARPNESS', '15')),
+        'min_contrast': float(os.getenv('OCR_MIN_CONTRAST', '12')),
+        'min_brightness': float(os.getenv('OCR_MIN_BRIGHTNESS', '25')),
+        'max_brightness': float(os.getenv('OCR_MAX_BRIGHTNESS', '235')),
+        # 0 = ไม่ข้ามป้ายตามขนาด
+        'min_width': int(os.getenv('OCR_MIN_PLATE_WIDTH', '0')),
+        'min_height': int(os.getenv('OCR_MIN_PLATE_HEIGHT', '0'))
+    }
+)
+
+# Keep-alive connection pool to the database service, shared by all request threads
+database_session = requests.Session()
+database_session.mount('http://', HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=int(os.getenv('HTTP_POOL_SIZE', '16'))
+))
+
 # Initialize directories
 DETECTION_FOLDER = os.getenv('DETECTION_FOLDER', 'detections')
 os.makedirs(DETECTION_FOLDER, exist_ok=True)
 
 def preprocess_plate_image(img):
-   """Preprocess license plate image for better OCR"""
-   try:
-       # Convert to grayscale
-       gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-       
-       # Apply adaptive thresholding
-       blur = cv2.GaussianBlur(gray, (5, 5), 0)
-       thresh = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                    cv2.THRESH_BINARY_INV, 11, 2)
-       
-       # Noise removal
-       kernel = np.ones((3,3), np.uint8)
-       opening = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, iterations=1)
-       
-       # Resize for better OCR
-       height, width = opening.shape
-       if width > 300:
-           scale = 300 / width
-           new_width = 300
-           new_height = int(height * scale)
-           opening = cv2.resize(opening, (new_width, new_height))
-           
-       return opening
-   except Exception as e:
-       print(f"Error preprocessing plate image: {e}")
-       return img
+   """
+   Preprocess license plate image for better OCR
+
+   Returns the processed image and the variant used. Raises UnreadablePlate when
+   the pre-check predicts OCR would fail, instead of falling back to the raw image.
+   """
+   with STAGE_LATENCY.labels(stage='preprocess').time():
+       processed_img, variant, _ = plate_preprocessor.prepare(img)
+   return processed_img, variant
 
 def read_license_plate(img):
    """Read license plate text using OCR"""
    try:
        # Preprocess image
-       processed_img = preprocess_plate_image(img)
+       processed_img, variant = preprocess_plate_image(img)
+       OCR_VARIANTS.labels(variant=variant).inc()
        
        # Run OCR
-       results = reader.readtext(processed_img)
+       with STAGE_LATENCY.labels(stage='ocr').time():
+           results = reader.readtext(processed_img)
        
        if results:
            # Combine all detected text
@@ -62,9 +87,14 @@ def read_license_plate(img):
            
            return text, confidence
        return 'Unknown', 0.0
-       
+
+   except UnreadablePlate as e:
+       # ภาพที่ pre-check คาดว่าอ่านไม่ได้ ไม่ต้องเสียเวลา OCR
+       OCR_SKIPPED.labels(reason=e.reason).inc()
+       logger.debug("Skipping OCR: %s", e.reason)
+       return 'Unknown', 0.0
    except Exception as e:
-       print(f"Error reading license plate: {e}")
+       logger.warning("Error reading license plate: %s", e)
        return 'Unknown', 0.0
 
 def save_violation_images(detection_id, motorcycle_img, plate_img):
@@ -81,7 +111,7 @@ def save_violation_images(detection_id, motorcycle_img, plate_img):
            'plate_image': f"{detection_id}_plate.jpg"
        }
    except Exception as e:
-       print(f"Error saving violation images: {e}")
+       logger.warning("Error saving violation images: %s", e)
        return None
 
 def process_violation(data):
@@ -107,40 +137,43 @@ def process_violation(data):
                 'confidence': data['confidence'],
                 'motorcycle_conf': data.get('motorcycle_conf', 0.0),
                 'no_helmet_conf': data.get('no_helmet_conf', 0.0),
-                'plate_conf': data.get('plate_conf', 0.0)
+                'plate_conf': data.get('plate_conf', 0.0),
+                'trace_id': data.get('trace_id')
             }
             
             # บันทึกลงฐานข้อมูล
             try:
-                response = requests.post(
-                    'http://database:5003/violations',
-                    json=violation_data,
-                    timeout=5
-                )
+                with HOP_LATENCY.labels(target='database').time():
+                    response = database_session.post(
+                        f'{DATABASE_URL}/violations',
+                        json=violation_data,
+                        headers={'X-Trace-Id': data.get('trace_id') or ''},
+                        timeout=5
+                    )
                 
                 if response.status_code != 200:
-                    print(f"ไม่สามารถบันทึกข้อมูลได้: {response.text}")
+                    logger.warning("ไม่สามารถบันทึกข้อมูลได้: %s", response.text)
                 
                 return violation_data
                 
             except requests.exceptions.Timeout:
-                print("หมดเวลาในการเชื่อมต่อฐานข้อมูล")
+                logger.warning("หมดเวลาในการเชื่อมต่อฐานข้อมูล")
             except Exception as e:
-                print(f"เกิดข้อผิดพลาดในการบันทึกข้อมูล: {e}")
+                logger.error("เกิดข้อผิดพลาดในการบันทึกข้อมูล: %s", e)
         
         return None
         
     except Exception as e:
-        print(f"เกิดข้อผิดพลาดในการประมวลผล: {e}")
+        logger.error("เกิดข้อผิดพลาดในการประมวลผล: %s", e)
         return None
 
-@app.route('/ocr/<filename>', methods=['GET'])
+@app.route('/ocr/<path:filename>', methods=['GET'])
 def get_license_plate(filename):
     """อ่านป้ายทะเบียนจากภาพ"""
     try:
-        # อ่านไฟล์ภาพ
-        image_path = os.path.join(DETECTION_FOLDER, filename)
-        if not os.path.exists(image_path):
+        # อ่านไฟล์ภาพ (path สัมพัทธ์ในโฟลเดอร์ย่อยรายวัน)
+        image_path = safe_join(DETECTION_FOLDER, filename)
+        if image_path is None or not os.path.exists(image_path):
             return jsonify({
                 'error': 'ไม่พบไฟล์ภาพ'
             }), 404
@@ -160,7 +193,7 @@ def get_license_plate(filename):
         })
         
     except Exception as e:
-        print(f"เกิดข้อผิดพลาดในการอ่านป้ายทะเบียน: {e}")
+        logger.error("เกิดข้อผิดพลาดในการอ่านป้ายทะเบียน: %s", e)
         return jsonify({'error': str(e)}), 500
 
 # @app.route('/process_frame', methods=['POST'])
@@ -185,32 +218,35 @@ def process_frame():
     try:
         data = request.get_json()
         if not data:
-            print("ไม่พบข้อมูลในคำขอ")
+            logger.warning("ไม่พบข้อมูลในคำขอ")
             return jsonify({'error': 'ไม่พบข้อมูล'}), 400
 
+        # รหัสติดตามจาก detector ส่งต่อไปยังฐานข้อมูล
+        trace_id = data.get('trace_id') or request.headers.get('X-Trace-Id') or uuid.uuid4().hex
+
         # ตรวจสอบข้อมูลที่จำเป็น
         required_fields = ['id', 'filename', 'frame_number', 'plate_image']
         missing_fields = [field for field in required_fields if field not in data]
         if missing_fields:
-            print(f"ข้อมูลไม่ครบถ้วน: ขาด {', '.join(missing_fields)}")
+            logger.warning("ข้อมูลไม่ครบถ้วน: ขาด %s (trace %s)", ', '.join(missing_fields), trace_id)
             return jsonify({'error': f'ข้อมูลไม่ครบถ้วน: {missing_fields}'}), 400
 
         # ตรวจสอบไฟล์ภาพป้ายทะเบียน
-        plate_path = os.path.join(DETECTION_FOLDER, data['plate_image'])
-        if not os.path.exists(plate_path):
-            print(f"ไม่พบไฟล์ภาพป้ายทะเบียน: {plate_path}")
+        plate_path = safe_join(DETECTION_FOLDER, data['plate_image'])
+        if plate_path is None or not os.path.exists(plate_path):
+            logger.warning("ไม่พบไฟล์ภาพป้ายทะเบียน: %s (trace %s)", plate_path, trace_id)
             return jsonify({'error': 'ไม่พบไฟล์ภาพป้ายทะเบียน'}), 404
 
         # อ่านไฟล์ภาพ
         plate_img = cv2.imread(plate_path)
         if plate_img is None:
-            print(f"ไม่สามารถอ่านไฟล์ภาพป้ายทะเบียนได้: {plate_path}")
+            logger.warning("ไม่สามารถอ่านไฟล์ภาพป้ายทะเบียนได้: %s (trace %s)", plate_path, trace_id)
             return jsonify({'error': 'ไม่สามารถอ่านไฟล์ภาพ'}), 400
 
-        print(f"เริ่มกระบวนการ OCR สำหรับไฟล์: {data['plate_image']}")
+        logger.debug("เริ่มกระบวนการ OCR สำหรับไฟล์: %s (trace %s)", data['plate_image'], trace_id)
         # อ่านตัวอักษรป้ายทะเบียน
         plate_text, ocr_confidence = read_license_plate(plate_img)
-        print(f"ผลการอ่าน OCR: ข้อความ='{plate_text}', ความแม่นยำ={ocr_confidence:.2f}")
+        logger.debug("ผลการอ่าน OCR: ข้อความ='%s', ความแม่นยำ=%.2f (trace %s)", plate_text, ocr_confidence, trace_id)
 
         # เตรียมข้อมูลสำหรับบันทึก
         violation_data = {
@@ -224,41 +260,60 @@ def process_frame():
             'confidence': data.get('confidence', 0.0),
             'motorcycle_conf': data.get('motorcycle_conf', 0.0),
             'no_helmet_conf': data.get('no_helmet_conf', 0.0),
-            'plate_conf': data.get('plate_conf', 0.0)
+            'plate_conf': data.get('plate_conf', 0.0),
+            'trace_id': trace_id
         }
 
         # บันทึกลงฐานข้อมูล
         try:
-            response = requests.post(
-                'http://database:5003/violations',
-                json=violation_data,
-                timeout=5
-            )
+            with HOP_LATENCY.labels(target='database').time():
+                response = database_session.post(
+                    f'{DATABASE_URL}/violations',
+                    json=violation_data,
+                    headers={'X-Trace-Id': trace_id},
+                    timeout=5
+                )
             
             if response.status_code == 200:
-                print(f"บันทึกข้อมูลสำเร็จ: ID={data['id']}")
+                logger.debug("บันทึกข้อมูลสำเร็จ: ID=%s (trace %s)", data['id'], trace_id)
                 return jsonify({
                     'success': True,
                     'message': 'บันทึกข้อมูลสำเร็จ',
                     'data': violation_data
                 })
             else:
-                print(f"ไม่สามารถบันทึกข้อมูลได้: {response.text}")
+                logger.warning("ไม่สามารถบันทึกข้อมูลได้: %s (trace %s)", response.text, trace_id)
                 return jsonify({
                     'error': f'ไม่สามารถบันทึกข้อมูลได้: {response.text}'
                 }), 500
                 
         except requests.exceptions.Timeout:
-            print("หมดเวลาในการเชื่อมต่อฐานข้อมูล")
+            logger.warning("หมดเวลาในการเชื่อมต่อฐานข้อมูล (trace %s)", trace_id)
             return jsonify({'error': 'หมดเวลาในการเชื่อมต่อฐานข้อมูล'}), 500
         except Exception as e:
-            print(f"เกิดข้อผิดพลาดในการบันทึกข้อมูล: {e}")
+            logger.error("เกิดข้อผิดพลาดในการบันทึกข้อมูล: %s (trace %s)", e, trace_id)
             return jsonify({'error': f'เกิดข้อผิดพลาดในการบันทึกข้อมูล: {str(e)}'}), 500
 
     except Exception as e:
-        print(f"เกิดข้อผิดพลาดในการประมวลผล: {e}")
+        logger.error("เกิดข้อผิดพลาดในการประมวลผล: %s", e)
         return jsonify({'error': str(e)}), 500
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    if request.url_rule is not None and hasattr(g, 'request_start'):
+        REQUEST_LATENCY.labels(request.method, request.url_rule.rule).observe(
+            time.perf_counter() - g.request_start)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics"""
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
 @app.route('/health', methods=['GET'])
 def health_check():
    """Health check endpoint"""
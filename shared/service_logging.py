@@ -0,0 +1,61 @@
+"""
+การตั้งค่า logging ที่ทุก service ใช้ร่วมกัน
+
+ไฟล์นี้อยู่นอก build context ของแต่ละ service docker-compose จึงส่งโฟลเดอร์ shared
+เป็น additional context (ชื่อ shared) และ Dockerfile คัดลอกเข้า /app ด้วย
+COPY --from=shared เมื่อรัน service นอก Docker ให้เพิ่มโฟลเดอร์นี้ใน PYTHONPATH
+(เช่น PYTHONPATH=../shared python detector.py)
+"""
+import logging
+import os
+import threading
+import time
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    จำกัด log ระดับ DEBUG/INFO ที่มีข้อความแม่แบบเดียวกันไม่เกิน rate ครั้งต่อ interval วินาที
+    ใช้กับ log รายเฟรมที่มีจำนวนมาก ส่วน WARNING ขึ้นไปผ่านทุกรายการเพื่อไม่ให้ความผิดพลาดจริงถูกซ่อน
+    """
+
+    def __init__(self, rate=5, interval=10.0, max_level=logging.INFO):
+        super().__init__()
+        self.rate = rate
+        self.interval = interval
+        self.max_level = max_level
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = (record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - start >= self.interval:
+                if suppressed:
+                    record.msg = f"{record.msg} (ข้ามข้อความซ้ำ {suppressed} ครั้ง)"
+                start, count, suppressed = now, 0, 0
+            if count < self.rate:
+                self._windows[key] = (start, count + 1, suppressed)
+                return True
+            self._windows[key] = (start, count, suppressed + 1)
+            return False
+
+
+def setup_logging(name):
+    """
+    ตั้งค่ารูปแบบและระดับของ log (LOG_LEVEL) และคืน logger ของ service ที่จำกัดจำนวน log
+    DEBUG/INFO ซ้ำตาม LOG_RATE_LIMIT ครั้งต่อ LOG_RATE_INTERVAL วินาที
+    """
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+    logger = logging.getLogger(name)
+    logger.addFilter(RateLimitFilter(
+        rate=int(os.getenv('LOG_RATE_LIMIT', '5')),
+        interval=float(os.getenv('LOG_RATE_INTERVAL', '10'))
+    ))
+    return logger